@@ -0,0 +1,634 @@
+""" Benchmarks for the performance critical parts of Praesidium.
+
+Run it from inside the praesidium folder:
+
+    python benchmark.py [results file]
+
+No card, reader or internet connection is needed: the card is
+simulated by `card_simulator`, the blockchain and Electrum servers are
+local stubs and the window is never shown. All results are also written as json
+into the results file (`benchmark_results.json` by default), so
+that the results of two commits can be compared.
+"""
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import StreamRequestHandler, TCPServer, ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen') # Headless
+
+import card_simulator
+import praesidium
+
+input_numbers = (1, 10, 50, 250)
+transaction_input_numbers = (1, 10, 50, 100, 250)
+address_formats = ('base58', 'bech32')
+startup_runs = 5
+transaction_runs = 3
+notification_runs = 5
+signing_inputs = 20 # Inputs signed with the latency of a real card
+key_scan_runs = 5
+scan_keypairs = 20 # Generated keypairs on the simulated card
+default_results_file = 'benchmark_results.json'
+
+# Runs Praesidium in a new process and ends it as soon as the window
+# is painted for the first time.
+startup_code = """
+import os
+import runpy
+import sys
+from PySide2.QtCore import QEvent, QObject
+from PySide2 import QtWidgets
+
+class first_paint(QObject):
+  def eventFilter(self, watched, event):
+    if((QEvent.Paint == event.type()) and isinstance(watched, QtWidgets.QWidget)
+        and isinstance(watched.window(), QtWidgets.QMainWindow)):
+      print('painted', flush = True)
+      os._exit(0)
+    return False
+
+class timed_application(QtWidgets.QApplication):
+  def __init__(self, *args):
+    super(timed_application, self).__init__(*args)
+    self.first_paint = first_paint()
+    self.installEventFilter(self.first_paint)
+
+QtWidgets.QApplication = timed_application
+if('QUiLoader' == sys.argv[1]):
+  sys.modules['ui_mainwindow'] = None # Forces the fallback to mainwindow.ui
+sys.path.insert(0, os.path.dirname(sys.argv[2]))
+runpy.run_path(sys.argv[2], run_name = 'praesidium')['main'](sys.argv[3])
+"""
+
+class null_logger:
+  """ Logger that throws away everything, so that only the
+  transaction building itself gets measured.
+  """
+  def write_to_file(self, log_text = None):
+    pass
+
+  def close(self, txid = None):
+    pass
+
+class bench_blockchain:
+  """ Stands in for `blockchain_info` with `input_number` made up
+  unspent outputs.
+  """
+  def __init__(self, input_number):
+    self._data = make_unspent_outputs(input_number)
+
+  def get_tx_hash(self, output_number):
+    return self._data[output_number]['tx_hash']
+
+  def get_tx_o_n(self, output_number):
+    return self._data[output_number]['tx_output_n']
+
+  def get_value(self, output_number):
+    return self._data[output_number]['value']
+
+  def get_total_input_number(self):
+    return len(self._data)
+
+  def get_bal_of_uo(self):
+    return sum(unspent_output['value'] for unspent_output in self._data)
+
+def make_unspent_outputs(input_number):
+  """ Makes up `input_number` unspent outputs, which are the same
+  on every run.
+  """
+  return [
+    {
+      'tx_hash': hashlib.sha256(struct.pack('<L', output)).hexdigest(),
+      'tx_output_n': output % 4,
+      'value': 10000 + output
+    }
+    for output in range(input_number)
+  ]
+
+class blockchain_stub(BaseHTTPRequestHandler):
+  """ Answers the requests Praesidium sends to blockchain.info.
+
+  Every address has `server.input_number` unspent outputs of
+  `make_unspent_outputs`. The `limit` of unspent output requests is
+  ignored, so that large transactions can be measured.
+  """
+  protocol_version = 'HTTP/1.1' # Keeps connections open like the real server
+  disable_nagle_algorithm = True # Headers and body are sent separately
+
+  def do_GET(self):
+    url_parts = urlsplit(self.path)
+    query = parse_qs(url_parts.query)
+    unspent_outputs = make_unspent_outputs(self.server.input_number)
+    if('/unspent' == url_parts.path):
+      answer = {'unspent_outputs': unspent_outputs}
+    elif('/balance' == url_parts.path):
+      balance = sum(unspent_output['value'] for unspent_output in unspent_outputs)
+      answer = {
+        btc_addr: {'final_balance': balance, 'n_tx': 1, 'total_received': balance}
+        for btc_addr in query['active'][0].split('|')
+      }
+    elif('/ticker' == url_parts.path):
+      answer = {'EUR': {'sell': 25000.0}}
+    else:
+      self.send_error(404)
+      return
+    self.server.requests = self.server.requests + 1
+    body = json.dumps(answer).encode()
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class stub_server(ThreadingMixIn, HTTPServer):
+  """ Runs `blockchain_stub` on a free port of localhost.
+  """
+  daemon_threads = True
+
+  def __init__(self):
+    HTTPServer.__init__(self, ('127.0.0.1', 0), blockchain_stub)
+    self.input_number = 1
+    self.requests = 0
+    threading.Thread(target = self.serve_forever, daemon = True).start()
+
+  def get_url(self):
+    return 'http://127.0.0.1:' + str(self.server_address[1])
+
+class electrum_stub(StreamRequestHandler):
+  """ Answers the requests Praesidium sends to an Electrum server.
+
+  Every address has the balance `server.balance`, which is pushed to
+  all subscribed addresses whenever it changes.
+  """
+  def handle(self):
+    self.subscriptions = set() # Script hashes
+    self.lock = threading.Lock() # Answers and notifications are sent by different threads
+    self.server.clients.append(self)
+    try:
+      for line in self.rfile:
+        request = json.loads(line.decode('utf-8'))
+        method, params = request['method'], request.get('params', [])
+        if('server.version' == method):
+          result = ['Electrum stub', '1.4']
+        elif('blockchain.scripthash.subscribe' == method):
+          self.subscriptions.add(params[0])
+          result = self.server.get_status()
+        elif('blockchain.scripthash.get_balance' == method):
+          result = {'confirmed': self.server.balance, 'unconfirmed': 0}
+        else:
+          self.send({'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32601, 'message': 'Unknown method'}})
+          continue
+        self.server.requests = self.server.requests + 1
+        self.send({'jsonrpc': '2.0', 'id': request['id'], 'result': result})
+    finally:
+      self.server.clients.remove(self)
+
+  def send(self, answer):
+    with self.lock:
+      self.wfile.write(json.dumps(answer).encode('utf-8') + b'\n')
+
+class electrum_stub_server(ThreadingMixIn, TCPServer):
+  """ Runs `electrum_stub` on a free port of localhost.
+  """
+  daemon_threads = True
+
+  def __init__(self):
+    TCPServer.__init__(self, ('127.0.0.1', 0), electrum_stub)
+    self.balance = 0
+    self.requests = 0
+    self.clients = []
+    threading.Thread(target = self.serve_forever, daemon = True).start()
+
+  def get_server(self):
+    """ Returns the server in the format of `electrum_server`.
+    """
+    return '127.0.0.1:' + str(self.server_address[1]) + ':t'
+
+  def get_status(self):
+    """ Returns the status of an address, which changes with its balance.
+    """
+    return hashlib.sha256(str(self.balance).encode()).hexdigest()
+
+  def set_balance(self, balance):
+    """ Changes the balance of every address and pushes the new 
+    status to every subscription.
+    """
+    self.balance = balance
+    for client in list(self.clients):
+      for script_hash in list(client.subscriptions):
+        client.send({'jsonrpc': '2.0', 'method': 'blockchain.scripthash.subscribe', 'params': [script_hash, self.get_status()]})
+
+def setup_praesidium(server, data_dir):
+  """ Sets up Praesidium like `praesidium.py` does when it is started,
+  but with the simulated card and the blockchain stub. Files are
+  only written into `data_dir`.
+  """
+  p = praesidium
+  p.developer = False
+  p.blockchain_url = server.get_url()
+  p.balance_notifications = 'poll'
+  p.coin_selection_strategy = 'all' # Every unspent output becomes an input
+  p.other_reader_names = []
+
+  p.setup(data_dir)
+  p.diagnostics.setLevel(logging.ERROR) # Status messages would only clutter the results
+
+  # The simulated card is on the reader right away
+  p.blocksec2go = card_simulator
+  simulated_card = card_simulator.simulated_card(seed = 1)
+  card_simulator.insert_card(p.reader_name, simulated_card)
+  for key_id in range(scan_keypairs):
+    simulated_card.generate_keypair()
+  p.reader.get_reader()
+  p.reader.card_connected = True
+
+def new_keypair_cache(data_dir):
+  """ Returns an empty keypair cache, saved inside `data_dir`.
+  """
+  cache_path = os.path.join(data_dir, 'keypair_cache.json')
+  if(os.path.exists(cache_path)):
+    os.remove(cache_path)
+  return praesidium.keypair_cache(cache_path)
+
+def teardown_praesidium():
+  """ Stops all threads and closes all connections of `setup_praesidium`.
+  """
+  p = praesidium
+  p.poll.stop()
+  p.scheduler.stop()
+  p.workers.shutdown(wait = True)
+  p.readers.shutdown(wait = True)
+  p.http_session.close()
+  p.tx_logs.close()
+  p.signing_sessions.close()
+
+def get_public_key(key_id = 1):
+  """ Returns the public key of keypair `key_id` on the simulated card.
+  """
+  global_counter, counter, public_key = praesidium.get_keypair_info(key_id)
+  return public_key
+
+def best_of(function, *args, repeat = 5):
+  """ Returns the fastest of `repeat` runs in seconds.
+  """
+  timer = timeit.Timer(lambda: function(*args))
+  number, _ = timer.autorange()
+  return min(timer.repeat(repeat, number)) / number
+
+def fastest_run(function, *args, repeat = 5):
+  """ Returns the fastest of `repeat` single runs in seconds, for
+  functions which take too long to be run many times.
+  """
+  times = []
+  for run in range(repeat):
+    start = time.perf_counter()
+    function(*args)
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+def make_sighash_data(input_number):
+  """ Builds everything that is needed to hash the transactions
+  which have to be signed, for `input_number` inputs.
+  """
+  tx_helper = praesidium.transaction_helper(bench_blockchain(input_number), null_logger())
+  pk_script = bytes.fromhex('76a914') + bytes(20) + bytes.fromhex('88ac')
+  prefix = tx_helper.get_version() + bytes([input_number])
+  outputs = struct.pack('<Q', 5000) + bytes([len(pk_script)]) + pk_script
+  suffix = (
+      bytes([0x01])
+    + outputs
+    + tx_helper.get_lock_time()
+    + tx_helper.get_hash_type_code('SIGHASH_ALL')
+    )
+  return tx_helper, pk_script, prefix, suffix
+
+def sighashes_rebuilt(input_number):
+  """ Hashes the transactions the way Praesidium did it before:
+  the whole unsigned transaction is rebuild for every input.
+  """
+  tx_helper, pk_script, prefix, suffix = make_sighash_data(input_number)
+  sighashes = [None] * input_number
+  for script in range(input_number):
+    All_Standard_TxIn = bytes()
+    Standard_TxIn = [None] * input_number
+    Standard_TxIn[script] = pk_script
+    for TxIn in range(input_number):
+      All_Standard_TxIn = All_Standard_TxIn + tx_helper.make_tx_input('unsigned', TxIn, Standard_TxIn)
+    tx_to_sign = prefix + All_Standard_TxIn + suffix
+    sighashes[script] = hashlib.sha256(hashlib.sha256(tx_to_sign).digest()).digest()
+  return sighashes
+
+def sighashes_template(input_number):
+  """ Hashes the transactions the way `transaction.make` does it now.
+  """
+  tx_helper, pk_script, prefix, suffix = make_sighash_data(input_number)
+  SubScript = [None] * input_number
+  Unsigned_TxIn = [None] * input_number
+  Signing_TxIn = [None] * input_number
+  for TxIn in range(input_number):
+    Unsigned_TxIn[TxIn] = tx_helper.make_tx_input('unsigned', TxIn, SubScript)
+  for TxIn in range(input_number):
+    SubScript[TxIn] = pk_script
+    Signing_TxIn[TxIn] = tx_helper.make_tx_input('unsigned', TxIn, SubScript)
+    SubScript[TxIn] = None
+  return tx_helper.get_legacy_sighashes(prefix, Unsigned_TxIn, Signing_TxIn, suffix)
+
+def bench_sighash():
+  """ Compares the old and the new way of hashing the transactions
+  which have to be signed.
+  """
+  results = []
+  print('Legacy sighash preparation:')
+  print('  %6s %14s %14s %8s' % ('inputs', 'rebuilt [ms]', 'template [ms]', 'speedup'))
+  for input_number in input_numbers:
+    if(sighashes_rebuilt(input_number) != sighashes_template(input_number)):
+      raise RuntimeError('Sighashes differ for ' + str(input_number) + ' inputs!')
+    rebuilt = best_of(sighashes_rebuilt, input_number)
+    template = best_of(sighashes_template, input_number)
+    print('  %6d %14.3f %14.3f %7.1fx' % (input_number, rebuilt * 1000, template * 1000, rebuilt / template))
+    results.append({'inputs': input_number, 'rebuilt_ms': rebuilt * 1000, 'template_ms': template * 1000})
+  return results
+
+def bench_addresses():
+  """ Measures how long it takes to turn a public key into an address.
+  """
+  results = []
+  public_key = get_public_key()
+  print('Address from public key:')
+  print('  %8s %10s' % ('format', 'time [us]'))
+  for address_format in address_formats:
+    praesidium.address_format = address_format
+    elapsed = best_of(praesidium.pub_key_to_BTC_Addr, public_key)
+    print('  %8s %10.1f' % (address_format, elapsed * 10**6))
+    results.append({'format': address_format, 'time_us': elapsed * 10**6})
+  praesidium.address_format = 'base58'
+  return results
+
+def make_all_tx_inputs(tx_helper, input_number):
+  SubScript = [None] * input_number
+  return [tx_helper.make_tx_input('unsigned', TxIn, SubScript) for TxIn in range(input_number)]
+
+def bench_tx_parts():
+  """ Measures building the inputs and the outputs of a transaction.
+  """
+  results = []
+  target_addrs = ('1638JQhRa95UAkpXpSQso7oH44Go33Prca', 'bc1qar0srrr7xfkvy5l643lydnw9re59gtzzwf5mdq')
+  own_addr = praesidium.pub_key_to_BTC_Addr(get_public_key())
+  print('Transaction inputs and outputs:')
+  print('  %6s %16s %10s %17s' % ('inputs', 'all inputs [ms]', 'payments', 'all outputs [us]'))
+  for input_number, payment_number in zip(input_numbers, (1, 2, 10, 100)):
+    payments = [(target_addrs[payment % 2], 1000) for payment in range(payment_number)]
+    tx_helper = praesidium.transaction_helper(bench_blockchain(input_number), null_logger(), payments, 1000, own_addr)
+    inputs = best_of(make_all_tx_inputs, tx_helper, input_number)
+    outputs = best_of(tx_helper.make_tx_outputs)
+    print('  %6d %16.3f %10d %17.1f' % (input_number, inputs * 1000, payment_number, outputs * 10**6))
+    results.append({
+      'inputs': input_number, 'make_tx_input_ms': inputs * 1000,
+      'payments': payment_number, 'make_tx_outputs_us': outputs * 10**6
+    })
+  return results
+
+def make_transaction(btc_addr, public_key):
+  tx = praesidium.transaction(btc_addr, null_logger(), [('1638JQhRa95UAkpXpSQso7oH44Go33Prca', 5000)], 1000, '1')
+  return tx.make(public_key)
+
+def bench_transaction(server):
+  """ Measures `transaction.make` with all its signatures, which
+  are made by the simulated card without any delay.
+  """
+  results = []
+  public_key = get_public_key()
+  print('Signed transaction (simulated card):')
+  print('  %8s %6s %10s %14s' % ('format', 'inputs', 'time [ms]', 'per input [ms]'))
+  for address_format in address_formats:
+    praesidium.address_format = address_format
+    btc_addr = praesidium.pub_key_to_BTC_Addr(public_key)
+    for input_number in transaction_input_numbers:
+      server.input_number = input_number
+      praesidium.utxos = praesidium.utxo_store() # Unspent outputs are requested again
+      praesidium.utxos.get_unspent_outputs(btc_addr)
+      elapsed = fastest_run(make_transaction, btc_addr, public_key, repeat = transaction_runs)
+      print('  %8s %6d %10.1f %14.2f' % (address_format, input_number, elapsed * 1000, elapsed * 1000 / input_number))
+      results.append({'format': address_format, 'inputs': input_number, 'time_ms': elapsed * 1000})
+  praesidium.address_format = 'base58'
+  server.input_number = 1
+  return results
+
+def sign_with_card_latency(btc_addr, public_key):
+  tx = praesidium.transaction(btc_addr, praesidium.log(btc_addr), [('1638JQhRa95UAkpXpSQso7oH44Go33Prca', 5000)], 1000, '1')
+  return tx.make(public_key)
+
+def bench_signing(server):
+  """ Measures a transaction signed with the latency of a real card
+  and logged like in Praesidium. The less time is left besides the
+  time the card needs, the less the card waits for Praesidium.
+  """
+  results = []
+  public_key = get_public_key()
+  card = praesidium.reader.reader.card
+  latency = card_simulator.realistic_latency['generate_signature']
+  card.latency = {'generate_signature': latency}
+  card_time = signing_inputs * latency
+  print('Signed transaction (card latency):')
+  print('  %8s %6s %10s %10s %15s' % ('format', 'inputs', 'time [ms]', 'card [ms]', 'overhead [ms]'))
+  for address_format in address_formats:
+    praesidium.address_format = address_format
+    btc_addr = praesidium.pub_key_to_BTC_Addr(public_key)
+    server.input_number = signing_inputs
+    praesidium.utxos = praesidium.utxo_store()
+    praesidium.utxos.get_unspent_outputs(btc_addr)
+    elapsed = fastest_run(sign_with_card_latency, btc_addr, public_key, repeat = 1)
+    print('  %8s %6d %10.1f %10.1f %15.1f' % (address_format, signing_inputs, elapsed * 1000, card_time * 1000, (elapsed - card_time) * 1000))
+    results.append({'format': address_format, 'inputs': signing_inputs, 'time_ms': elapsed * 1000, 'card_ms': card_time * 1000})
+  card.latency = {}
+  praesidium.address_format = 'base58'
+  server.input_number = 1
+  return results
+
+def scan_keys(data_dir):
+  """ Verifies all keypairs like a newly inserted, unknown card and
+  waits until the result is saved.
+  """
+  praesidium.key_cache = new_keypair_cache(data_dir)
+  ui = praesidium.ui
+  ui.keypairs.verify(ui.window)
+  while(None == praesidium.key_cache.get_key_list(ui.keypairs.get_key_id_max())):
+    praesidium.app.processEvents()
+
+def bench_key_scan(data_dir):
+  """ Measures verifying all keypair slots, including painting them.
+  """
+  key_id_max = praesidium.ui.keypairs.get_key_id_max()
+  elapsed = fastest_run(scan_keys, data_dir, repeat = key_scan_runs)
+  print('Keypair scan (simulated card):')
+  print('  %6s %10s %13s' % ('slots', 'time [ms]', 'per slot [us]'))
+  print('  %6d %10.1f %13.1f' % (key_id_max, elapsed * 1000, elapsed * 10**6 / key_id_max))
+  return [{'slots': key_id_max, 'time_ms': elapsed * 1000}]
+
+def poll_balance(blockchain_poll, btc_addr):
+  blockchain_poll.update_currency_rate(btc_addr)
+  praesidium.poll.stop()
+
+def bench_polling(server):
+  """ Measures one update of the balance and the exchange rate,
+  from the request to the stub to the text on the UI.
+  """
+  btc_addr = praesidium.pub_key_to_BTC_Addr(get_public_key())
+  praesidium.utxos = praesidium.utxo_store() # Forgets the outputs of `bench_transaction`
+  blockchain_poll = praesidium.blockchain_info_poll(btc_addr)
+  praesidium.poll.stop()
+  requests = server.requests
+  elapsed = best_of(poll_balance, blockchain_poll, btc_addr)
+  print('Balance poll (local stub):')
+  print('  %10s' % ('time [ms]'))
+  print('  %10.3f' % (elapsed * 1000))
+  if(server.requests == requests):
+    raise RuntimeError('The balance was not polled!')
+  return [{'time_ms': elapsed * 1000}]
+
+def push_balance(electrum):
+  """ Lets the Electrum stub push a new balance and waits until it 
+  is shown on the UI.
+  """
+  balance = electrum.balance + 1
+  electrum.set_balance(balance)
+  shown = '\n' + str(balance) + ' Satoshi'
+  deadline = time.perf_counter() + 10
+  while(shown not in praesidium.ui.balance.text()):
+    if(time.perf_counter() > deadline):
+      raise RuntimeError('The pushed balance was not shown!')
+    praesidium.app.processEvents()
+
+def bench_notifications(electrum):
+  """ Measures how long a balance change takes from the Electrum stub
+  to the text on the UI, with the request of the new balance.
+  """
+  p = praesidium
+  btc_addr = p.pub_key_to_BTC_Addr(get_public_key())
+  p.balance_notifications = 'electrum'
+  p.electrum_server = electrum.get_server()
+  blockchain_poll = p.blockchain_info_poll(btc_addr)
+  try:
+    if(None == blockchain_poll.notifier):
+      raise RuntimeError('Not subscribed to the Electrum stub!')
+    elapsed = best_of(push_balance, electrum, repeat = notification_runs)
+  finally:
+    blockchain_poll.stop()
+    p.balance_notifications = 'poll'
+  print('Balance notification (local Electrum stub):')
+  print('  %10s' % ('time [ms]'))
+  print('  %10.3f' % (elapsed * 1000))
+  return [{'time_ms': elapsed * 1000}]
+
+def time_to_first_paint(ui_mode, data_dir):
+  """ Returns the seconds from starting Praesidium until its window
+  is painted, including the start of the Python interpreter. Files
+  are only written into `data_dir`.
+  """
+  start = time.perf_counter()
+  result = subprocess.run(
+      [sys.executable, '-c', startup_code, ui_mode, praesidium.__file__, data_dir],
+      stdout = subprocess.PIPE,
+      stderr = subprocess.DEVNULL,
+      timeout = 60
+    )
+  elapsed = time.perf_counter() - start
+  if(b'painted' not in result.stdout):
+    raise RuntimeError('Window was not painted with ' + ui_mode + '!')
+  return elapsed
+
+def bench_startup(data_dir):
+  """ Measures how long it takes until the window shows up, with
+  `mainwindow.ui` and, if it is up to date, with `ui_mainwindow.py`.
+  """
+  results = []
+  ui_modes = ['QUiLoader']
+  source_dir = os.path.dirname(praesidium.__file__)
+  ui_file_loc = os.path.join(source_dir, 'mainwindow.ui')
+  compiled_ui_loc = os.path.join(source_dir, 'ui_mainwindow.py')
+  if(os.path.isfile(compiled_ui_loc) and (os.path.getmtime(compiled_ui_loc) >= os.path.getmtime(ui_file_loc))):
+    ui_modes.append('precompiled')
+
+  print('Startup until the window is painted:')
+  print('  %12s %10s %12s' % ('ui', 'best [ms]', 'median [ms]'))
+  for ui_mode in ui_modes:
+    times = sorted(time_to_first_paint(ui_mode, data_dir) for run in range(startup_runs))
+    print('  %12s %10.0f %12.0f' % (ui_mode, times[0] * 1000, times[len(times) // 2] * 1000))
+    results.append({'ui': ui_mode, 'best_ms': times[0] * 1000, 'median_ms': times[len(times) // 2] * 1000})
+  return results
+
+def get_commit():
+  """ Returns the git commit that is measured, if there is one.
+  """
+  try:
+    return subprocess.run(
+        ['git', 'rev-parse', 'HEAD'],
+        stdout = subprocess.PIPE,
+        stderr = subprocess.DEVNULL,
+        cwd = os.path.dirname(os.path.abspath(praesidium.__file__))
+      ).stdout.decode().strip() or None
+  except OSError:
+    return None
+
+def run_all():
+  """ Runs every benchmark and returns all results.
+  """
+  results = {
+    'commit': get_commit(),
+    'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'benchmarks': {}
+  }
+  benchmarks = results['benchmarks']
+  benchmarks['sighash'] = bench_sighash()
+
+  server = stub_server()
+  electrum = electrum_stub_server()
+  data_dir = tempfile.mkdtemp(prefix = 'praesidium_benchmark_')
+  try:
+    setup_praesidium(server, data_dir)
+    benchmarks['address'] = bench_addresses()
+    benchmarks['tx_parts'] = bench_tx_parts()
+    benchmarks['transaction'] = bench_transaction(server)
+    benchmarks['signing'] = bench_signing(server)
+    benchmarks['key_scan'] = bench_key_scan(data_dir)
+    benchmarks['polling'] = bench_polling(server)
+    benchmarks['notifications'] = bench_notifications(electrum)
+  finally:
+    teardown_praesidium()
+    server.shutdown()
+    server.server_close()
+    electrum.shutdown()
+    electrum.server_close()
+    shutil.rmtree(data_dir, ignore_errors = True)
+
+  data_dir = tempfile.mkdtemp(prefix = 'praesidium_benchmark_')
+  try:
+    benchmarks['startup'] = bench_startup(data_dir)
+  finally:
+    shutil.rmtree(data_dir, ignore_errors = True)
+  return results
+
+if __name__ == '__main__':
+  results_file = sys.argv[1] if(len(sys.argv) > 1) else default_results_file
+  results = run_all()
+  with open(results_file, 'w') as results_output:
+    json.dump(results, results_output, indent = 2)
+  print('Results saved in ' + results_file)
@@ -0,0 +1,391 @@
+""" Simulated Blockchain Security 2Go card and reader.
+
+Stands in for the parts of the blocksec2go library which Praesidium
+uses, so that everything can be run, benchmarked and tested without
+a card or a reader. Keypairs are generated and signatures are made
+in process on the secp256k1 curve. Set `simulate_card = True` inside
+`praesidium.py` to use it, or use it directly:
+
+    import card_simulator as blocksec2go
+    blocksec2go.insert_card('Simulated reader', blocksec2go.simulated_card())
+    reader = blocksec2go.find_reader('Simulated reader')
+    key_id = blocksec2go.generate_keypair(reader)
+"""
+import hashlib
+import hmac
+import random
+import threading
+import time
+import traceback
+from queue import Queue
+
+# secp256k1 curve parameters
+P = 2**256 - 2**32 - 977
+N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (
+  0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+  0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8
+)
+
+# Rough time in seconds each command takes on a real card and reader.
+realistic_latency = {
+  'find_reader': 0.02,
+  'select_app': 0.04,
+  'get_key_info': 0.05,
+  'is_key_valid': 0.05,
+  'verify_pin': 0.07,
+  'generate_keypair': 0.3,
+  'generate_signature': 0.25
+}
+
+key_id_max = 0xFD
+global_counter_max = 1000000 # Signatures of the whole card
+counter_max = 100000 # Signatures of each keypair
+pin_tries_max = 3
+
+class CardError(Exception):
+  """ Error answer of the simulated card.
+  """
+  pass
+
+## secp256k1 related functions:
+def inverse(value, modulus):
+  """ Returns the modular inverse of `value`, `modulus` has to be prime.
+  """
+  return pow(value, modulus - 2, modulus)
+
+def point_double(point):
+  """ Doubles a point in Jacobian coordinates.
+  """
+  x, y, z = point
+  if(0 == y):
+    return (0, 0, 0)
+  y_squared = y * y % P
+  s = 4 * x * y_squared % P
+  m = 3 * x * x % P
+  new_x = (m * m - 2 * s) % P
+  new_y = (m * (s - new_x) - 8 * y_squared * y_squared) % P
+  new_z = 2 * y * z % P
+  return (new_x, new_y, new_z)
+
+def point_add(point, other):
+  """ Adds two points in Jacobian coordinates.
+  """
+  if(0 == point[2]):
+    return other
+  if(0 == other[2]):
+    return point
+  x1, y1, z1 = point
+  x2, y2, z2 = other
+  z1_squared = z1 * z1 % P
+  z2_squared = z2 * z2 % P
+  u1 = x1 * z2_squared % P
+  u2 = x2 * z1_squared % P
+  s1 = y1 * z2_squared * z2 % P
+  s2 = y2 * z1_squared * z1 % P
+  if(u1 == u2):
+    if(s1 != s2):
+      return (0, 0, 0)
+    return point_double(point)
+  h = (u2 - u1) % P
+  r = (s2 - s1) % P
+  h_squared = h * h % P
+  h_cubed = h * h_squared % P
+  u1_h_squared = u1 * h_squared % P
+  new_x = (r * r - h_cubed - 2 * u1_h_squared) % P
+  new_y = (r * (u1_h_squared - new_x) - s1 * h_cubed) % P
+  new_z = h * z1 * z2 % P
+  return (new_x, new_y, new_z)
+
+def point_multiply(scalar, point = G):
+  """ Returns `scalar` times `point` in affine coordinates.
+  """
+  result = (0, 0, 0)
+  addend = (point[0], point[1], 1)
+  while(scalar):
+    if(scalar & 1):
+      result = point_add(result, addend)
+    addend = point_double(addend)
+    scalar >>= 1
+  x, y, z = result
+  z_inverse = inverse(z, P)
+  return (x * z_inverse * z_inverse % P, y * z_inverse * z_inverse * z_inverse % P)
+
+def public_key_of(private_key):
+  """ Returns the uncompressed public key of `private_key` (65 bytes).
+  """
+  x, y = point_multiply(private_key)
+  return bytes([0x04]) + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+
+def deterministic_nonce(private_key, hashed_message):
+  """ Derives the nonce of a signature as described in RFC 6979,
+  so that signing the same hash twice gives the same signature.
+  """
+  key = private_key.to_bytes(32, 'big')
+  message = (int.from_bytes(hashed_message, 'big') % N).to_bytes(32, 'big')
+  v = bytes([0x01]) * 32
+  k = bytes(32)
+  k = hmac.new(k, v + bytes([0x00]) + key + message, hashlib.sha256).digest()
+  v = hmac.new(k, v, hashlib.sha256).digest()
+  k = hmac.new(k, v + bytes([0x01]) + key + message, hashlib.sha256).digest()
+  v = hmac.new(k, v, hashlib.sha256).digest()
+  while(True):
+    v = hmac.new(k, v, hashlib.sha256).digest()
+    nonce = int.from_bytes(v, 'big')
+    if(1 <= nonce < N):
+      return nonce
+    k = hmac.new(k, v + bytes([0x00]), hashlib.sha256).digest()
+    v = hmac.new(k, v, hashlib.sha256).digest()
+
+def der_integer(value):
+  """ DER encodes a positive integer.
+  """
+  encoded = value.to_bytes((value.bit_length() + 7) // 8 or 1, 'big')
+  if(encoded[0] & 0x80):
+    encoded = bytes([0x00]) + encoded # Keeps the integer positive
+  return bytes([0x02, len(encoded)]) + encoded
+
+def sign(private_key, hashed_message):
+  """ Signs the 32 byte `hashed_message` and returns the DER encoded
+  signature with a low `s` value, as Bitcoin requires.
+  """
+  z = int.from_bytes(hashed_message, 'big')
+  while(True):
+    nonce = deterministic_nonce(private_key, hashed_message)
+    r = point_multiply(nonce)[0] % N
+    s = inverse(nonce, N) * (z + r * private_key) % N
+    if(r and s):
+      break
+    hashed_message = hashlib.sha256(hashed_message).digest() # Practically never happens
+  if(s > N // 2):
+    s = N - s
+  body = der_integer(r) + der_integer(s)
+  return bytes([0x30, len(body)]) + body
+
+## Card / reader related classes and functions:
+class simulated_card:
+  """ Keypairs, counters and PIN of one simulated card.
+
+  `latency` maps command names (see `realistic_latency`) to the
+  seconds the command takes, `jitter` varies them randomly by
+  up to that share. `failures` maps command names to the chance
+  (0 to 1) that the command fails with a `CardError`. With a `seed`
+  the keypairs, delays and failures are the same on every run.
+  """
+  def __init__(self, pin = None, latency = None, jitter = 0, failures = None, seed = None):
+    self.latency = dict(latency or {})
+    self.jitter = jitter
+    self.failures = dict(failures or {})
+    self._random = random.Random(seed) if(None != seed) else random.SystemRandom()
+    self._lock = threading.Lock()
+    self._private_keys = {} # Key ID -> private key
+    self._public_keys = {} # Key ID -> public key
+    self._counters = {} # Key ID -> signatures left
+    self.global_counter = global_counter_max
+    self.pin = pin
+    self.pin_tries = pin_tries_max
+    self.pin_verified = False
+    self.card_id = bytes(self._random.getrandbits(8) for byte in range(11))
+    self.commands = {} # Command -> how often it was sent
+
+  def command(self, name):
+    """ Counts the command `name`, waits as long as it takes and
+    fails it if a failure is injected.
+    """
+    with self._lock:
+      self.commands[name] = self.commands.get(name, 0) + 1
+      delay = self.latency.get(name, 0)
+      if(delay and self.jitter):
+        delay = delay * (1 + self._random.uniform(-self.jitter, self.jitter))
+      failed = self._random.random() < self.failures.get(name, 0)
+    if(delay > 0):
+      time.sleep(delay)
+    if(failed):
+      raise CardError('Simulated failure of ' + name)
+
+  def select_app(self):
+    """ Resets the PIN verification, like selecting the app on a real card.
+    """
+    self.command('select_app')
+    self.pin_verified = False
+    return (None != self.pin), self.card_id, '1.0'
+
+  def generate_keypair(self):
+    self.command('generate_keypair')
+    with self._lock:
+      if(len(self._private_keys) >= key_id_max):
+        raise CardError('No free keypair slot left')
+      key_id = len(self._private_keys) + 1
+      self._private_keys[key_id] = self._random.randrange(1, N)
+      self._counters[key_id] = counter_max
+    return key_id
+
+  def get_public_key(self, key_id):
+    """ Returns the public key of `key_id`, which is only computed once.
+    """
+    public_key = self._public_keys.get(key_id)
+    if(None == public_key):
+      public_key = public_key_of(self._private_keys[key_id])
+      self._public_keys[key_id] = public_key
+    return public_key
+
+  def get_key_info(self, key_id):
+    self.command('get_key_info')
+    if(key_id not in self._private_keys):
+      raise CardError('Invalid keypair ' + str(key_id))
+    return self.global_counter, self._counters[key_id], self.get_public_key(key_id)
+
+  def is_key_valid(self, key_id):
+    self.command('is_key_valid')
+    return key_id in self._private_keys
+
+  def verify_pin(self, pin):
+    """ Returns `True` for the right PIN, otherwise the tries left.
+
+    Like a real card without a PIN, a card without `pin` refuses to
+    verify any PIN and keeps its tries.
+    """
+    self.command('verify_pin')
+    if(None == self.pin):
+      raise CardError('No PIN set on the card')
+    with self._lock:
+      if(0 == self.pin_tries):
+        return 0
+      if(pin == self.pin):
+        self.pin_tries = pin_tries_max
+        self.pin_verified = True
+        return True
+      self.pin_tries = self.pin_tries - 1
+      return self.pin_tries
+
+  def generate_signature(self, key_id, hashed_tx):
+    self.command('generate_signature')
+    if(key_id not in self._private_keys):
+      raise CardError('Invalid keypair ' + str(key_id))
+    if((None != self.pin) and not self.pin_verified):
+      raise CardError('PIN not verified')
+    if(32 != len(hashed_tx)):
+      raise CardError('Hash has to be 32 bytes long')
+    with self._lock:
+      if((0 == self.global_counter) or (0 == self._counters[key_id])):
+        raise CardError('Signature counter exhausted')
+      self.global_counter = self.global_counter - 1
+      self._counters[key_id] = self._counters[key_id] - 1
+      global_counter, counter = self.global_counter, self._counters[key_id]
+    return global_counter, counter, sign(self._private_keys[key_id], bytes(hashed_tx))
+
+class simulated_reader:
+  """ Reader which may hold a `simulated_card`.
+  """
+  def __init__(self, name):
+    self.name = name
+    self.card = None
+
+  def get_card(self):
+    if(None == self.card):
+      raise CardError('No card on reader')
+    return self.card
+
+readers = [] # All simulated readers
+callbacks = [] # (connect, disconnect)
+events = Queue() # (event, reader, callbacks) in the order they happened, see deliver
+delivery = None # Thread which calls the callbacks
+delivery_lock = threading.Lock()
+
+def insert_card(reader_name, card):
+  """ Puts `card` on the reader `reader_name`, which gets created
+  if it does not exist yet.
+  """
+  for reader in readers:
+    if(reader_name == reader.name):
+      break
+  else:
+    reader = simulated_reader(reader_name)
+    readers.append(reader)
+  reader.card = card
+  notify(0, reader)
+  return reader
+
+def remove_card(reader_name):
+  """ Takes the card off the reader `reader_name`.
+  """
+  for reader in readers:
+    if((reader_name == reader.name) and reader.card):
+      reader.card = None
+      notify(1, reader)
+
+def notify(event, reader, targets = None):
+  """ Calls the connect (`event` 0) or disconnect (`event` 1) callbacks, 
+  all or only `targets`, on the thread of the simulated card observer.
+
+  Like with the card observer of the library, the callbacks of one 
+  event are done before those of the next event are called, even 
+  with several readers.
+  """
+  global delivery
+  events.put((event, reader, targets))
+  with delivery_lock:
+    if(None == delivery):
+      delivery = threading.Thread(target = deliver, daemon = True)
+      delivery.start()
+
+def deliver():
+  """ Delivers the events of `notify` one after another.
+  """
+  while True:
+    event, reader, targets = events.get()
+    for callback in (targets or list(callbacks)):
+      try:
+        callback[event](reader)
+      except Exception:
+        traceback.print_exc() # Later events are still delivered
+
+## blocksec2go functions used by Praesidium:
+def find_reader(reader_name):
+  """ Returns the first reader with `reader_name` in its name.
+  """
+  for reader in readers:
+    if(reader_name in reader.name):
+      if(None == reader.card):
+        raise CardError('No card on reader')
+      reader.card.command('find_reader')
+      return reader
+  raise CardError('No reader found')
+
+def select_app(reader):
+  return reader.get_card().select_app()
+
+def generate_keypair(reader):
+  return reader.get_card().generate_keypair()
+
+def get_key_info(reader, key_id):
+  return reader.get_card().get_key_info(key_id)
+
+def is_key_valid(reader, key_id):
+  return reader.get_card().is_key_valid(key_id)
+
+def verify_pin(reader, pin):
+  return reader.get_card().verify_pin(pin)
+
+def generate_signature(reader, key_id, hashed_tx):
+  return reader.get_card().generate_signature(key_id, hashed_tx)
+
+def add_callback(connect, disconnect):
+  """ Calls `connect` and `disconnect` whenever a card is put on
+  or taken off a reader, starting with the cards already on one.
+  """
+  callbacks.append((connect, disconnect))
+  for reader in readers:
+    if(reader.card):
+      notify(0, reader, [(connect, disconnect)])
+
+class card_observer:
+  """ Stands in for `blocksec2go.comm.observer`.
+  """
+  def start(self):
+    return None, None
+
+  def stop(self, cardmonitor, cardobserver):
+    del callbacks[:]
+
+observer = card_observer()
@@ -1,32 +1,82 @@
 import os
-from time import sleep
+from time import sleep, time, monotonic, strftime, localtime
 import threading
+import heapq
+import itertools
 from functools import partial
+from contextlib import contextmanager
 import struct
-from urllib.parse import urlencode
-from urllib.request import urlopen, Request
+from urllib.parse import urlencode, urlsplit
+import http.client
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import gzip
 import json
+import logging
+import sys
+from collections import deque
+from queue import Queue
 import hashlib
-
-# After done, only use needed imports
-from PySide2.QtUiTools import QUiLoader
-from PySide2.QtGui import *
-from PySide2.QtWidgets import *
-from PySide2.QtCore import *
-
-import blocksec2go
-from blocksec2go.comm import observer
-
-import base58
-import bech32
-import qrcode
+import csv
+import sqlite3
+import socket
+import ssl
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide2.QtGui import QColor, QFont, QImage, QIntValidator, QPainter, QPixmap
+from PySide2.QtWidgets import (
+    QAbstractItemView, QApplication, QFileDialog, QFrame, QGridLayout, 
+    QHBoxLayout, QHeaderView, QLabel, QLineEdit, QMainWindow, QMenu, 
+    QPushButton, QSizePolicy, QTableWidget, QTableWidgetItem, QTextBrowser, 
+    QVBoxLayout, QWidget
+  )
+from PySide2.QtCore import QFile, QObject, QRect, Qt, QTimer, Signal
+
+# blocksec2go (or card_simulator), base58, bech32, qrcode and QUiLoader 
+# are imported where they are needed, so that the window shows up sooner.
 
 developer = True
 reader_name = 'Identiv uTrust 3700 F'
+# Signing stations with several readers: the names of the other readers, 
+# e.g. ['ACS ACR1252']. Every reader gets its own session and worker, so 
+# cards on different readers are used at the same time. Each name has to 
+# match only its own reader, no name may be part of another reader's name.
+other_reader_names = []
+# Use a simulated card on a simulated reader (see card_simulator.py) 
+# instead of the blocksec2go library, e.g. to try Praesidium without a card.
+simulate_card = False
 default_wait = 10 # Seconds
 # On weaker systems you might want to increase the 
 # polling multiplier.
 polling_multiplier = 3
+# All blockchain data is requested from this server. 
+# Change it to test against a local server.
+blockchain_url = 'https://blockchain.info'
+# Address format of the selected keypair:
+# 'base58' for legacy addresses (1...) or 
+# 'bech32' for native SegWit addresses (bc1...).
+address_format = 'base58'
+# Which unspent outputs get spent by a transaction:
+# 'branch_and_bound' (as few as possible, ideally without change),
+# 'largest_first' or 'all' (every unspent output).
+coin_selection_strategy = 'branch_and_bound'
+# How changes of the balance are noticed:
+# 'poll' asks `blockchain_url` every `default_wait * polling_multiplier` 
+# seconds, 'electrum' lets an Electrum server push them as they happen. 
+# Keep in mind that the Electrum server learns every selected address. 
+# Polling is also used whenever the Electrum server is not reachable.
+balance_notifications = 'poll'
+# Electrum server as 'host:port:protocol', where protocol is 
+# 's' for SSL or 't' for plain TCP (e.g. to test against a local server).
+electrum_server = 'electrum.blockstream.info:50002:s'
+# How many of the latest messages are kept in memory (see `events`).
+event_buffer_size = 500
+# Latencies of card commands and HTTP requests are measured in `metrics`.
+# To let Prometheus scrape them, set a port for an endpoint on localhost 
+# (e.g. 9464). To write them into a file every `metrics_interval` seconds, 
+# set a file name (e.g. 'metrics.prom', saved in the praesidium folder).
+metrics_port = None
+metrics_file = None
+metrics_interval = 60 # Seconds
 
 ## Utility related classes and functions:
 class Warning(Exception):
@@ -42,11 +92,128 @@ class SpellingMistake(Exception):
   def __init__(self, message = 'Please check for spelling mistakes in code!'):
     super(Exception, self).__init__(message)
 
+class scheduled_job:
+  """ Handle of a job of the `job_scheduler`, which can be 
+  used to cancel it.
+  """
+  def __init__(self, function, args, kwargs, interval = None, name = None):
+    self.function = function
+    self.args = args
+    self.kwargs = kwargs
+    self.interval = interval # Only set for recurring jobs
+    self.name = name
+    self.cancelled = False
+
+  def cancel(self):
+    """ Makes sure the job does not run (again).
+    """
+    self.cancelled = True
+
+class job_scheduler:
+  """ Runs delayed and recurring jobs on one single thread.
+
+  The jobs are kept in a heap ordered by when they are due, so the 
+  thread only wakes up when the next job is due or a new one is 
+  added. Jobs should be short, blocking work belongs on `workers`.
+  """
+  def __init__(self):
+    self._heap = [] # (due, order, job)
+    self._order = itertools.count() # Keeps jobs which are due at the same time in order
+    self._named = {} # Name -> recurring job
+    self._compact_size = 64 # Heap size at which cancelled jobs get removed
+    self._condition = threading.Condition()
+    self._thread = None
+    self._running = True
+
+  def call_later(self, delay, function, *args, **kwargs):
+    """ Runs `function` once after `delay` seconds and returns 
+    its `scheduled_job`.
+    """
+    job = scheduled_job(function, args, kwargs)
+    self._schedule(job, delay)
+    return job
+
+  def call_every(self, name, interval, function, *args, delay = None):
+    """ Runs `function` every `interval` seconds, the first time 
+    after `delay` seconds (default: `interval`).
+
+    A recurring job with the same `name` gets replaced.
+    """
+    job = scheduled_job(function, args, {}, interval, name)
+    with self._condition:
+      self.cancel(name)
+      self._named[name] = job
+    self._schedule(job, interval if(None == delay) else delay)
+    return job
+
+  def cancel(self, name):
+    """ Cancels the recurring job `name`, if it exists.
+    """
+    with self._condition:
+      job = self._named.pop(name, None)
+    if(job):
+      job.cancel()
+
+  def is_scheduled(self, name):
+    """ Returns whether the recurring job `name` exists.
+    """
+    return name in self._named
+
+  def stop(self):
+    """ Stops the scheduler thread, jobs which are not due yet 
+    are dropped.
+    """
+    with self._condition:
+      self._running = False
+      self._heap = []
+      self._named.clear()
+      self._condition.notify()
+
+  def _schedule(self, job, delay):
+    with self._condition:
+      heapq.heappush(self._heap, (monotonic() + delay, next(self._order), job))
+      if(len(self._heap) > self._compact_size):
+        # Cancelled jobs stay in the heap until they are due, 
+        # e.g. every message cancels the previous 'Waiting...'.
+        self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+        heapq.heapify(self._heap)
+        self._compact_size = max(64, 2 * len(self._heap))
+      if(None == self._thread):
+        self._thread = threading.Thread(target = self._run, name = 'scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+      self._condition.notify()
+
+  def _run(self):
+    while(True):
+      with self._condition:
+        while(self._running and ((not self._heap) or (self._heap[0][0] > monotonic()))):
+          self._condition.wait(self._heap[0][0] - monotonic() if(self._heap) else None)
+        if(not self._running):
+          return
+        due, order, job = heapq.heappop(self._heap)
+        if(job.cancelled):
+          continue
+        if(None != job.interval):
+          # If the job fell behind (e.g. the system was suspended), 
+          # its missed runs are skipped instead of run back to back.
+          missed = (monotonic() - due) // job.interval
+          heapq.heappush(self._heap, (due + (missed + 1) * job.interval, next(self._order), job))
+
+      try:
+        job.function(*job.args, **job.kwargs)
+      except Exception as details:
+        message('Scheduled job failed: %s', 'dev', details)
+
 class timer_class:
   """ Wrapper to execute function with a delay.
+
+  The function is run by the `scheduler`, or handed to `workers` 
+  if `on_worker` is set because it blocks.
   """
-  def __init__(self):
-    self.timer_thread = None
+  def __init__(self, on_worker = False):
+    self.on_worker = on_worker
+    self.job = None
 
   def start(self, interval, function, *args, **kwargs):
     """ Executes `function` after `interval` seconds.
@@ -55,98 +222,911 @@ class timer_class:
     be executed at a time.
     """
     self.stop()
-    self.timer_thread = threading.Timer(interval, function, args, kwargs)
-    self.timer_thread.daemon = True
-    self.timer_thread.start()
+    if(self.on_worker):
+      self.job = scheduler.call_later(interval, workers.submit, partial(function, *args, **kwargs))
+    else:
+      self.job = scheduler.call_later(interval, function, *args, **kwargs)
 
   def stop(self):
     """ Cancels the execution of a function that has been delayed.
     """
-    if(self.timer_thread):
-      self.timer_thread.cancel()
-      self.timer_thread = None
+    if(self.job):
+      self.job.cancel()
+      self.job = None
+
+class gui_dispatcher(QObject):
+  """ Runs functions on the GUI thread.
+
+  Widgets may only be changed by the GUI thread. Other threads hand 
+  their changes over through a Qt signal instead.
+  """
+  _call = Signal(object)
+
+  def __init__(self):
+    super(gui_dispatcher, self).__init__()
+    self._call.connect(self._run)
+
+  def call(self, function, *args, **kwargs):
+    """ Runs `function` on the GUI thread.
+
+    If this already is the GUI thread, `function` runs right away.
+    """
+    if(threading.current_thread() is threading.main_thread()):
+      self._run(partial(function, *args, **kwargs))
+    else:
+      self._call.emit(partial(function, *args, **kwargs))
+
+  def _run(self, function):
+    try:
+      function()
+    except Warning as details:
+      message(str(details), 'warn')
+    except Exception as details:
+      message(str(details), 'error')
+
+class worker_pool:
+  """ Runs blocking work, such as requests to the server and commands 
+  to the card, on a fixed number of threads.
+
+  Results and errors are handed back to the GUI thread.
+  """
+  def __init__(self, max_workers = 4):
+    self._executor = ThreadPoolExecutor(max_workers = max_workers)
+
+  def submit(self, function, *args, on_done = None, on_error = None):
+    """ Runs `function` on a worker thread.
+
+    Afterwards `on_done` is called with the result or `on_error` with 
+    the exception on the GUI thread. Without `on_error`, the exception 
+    is shown in the status bar.
+    """
+    future = self._executor.submit(function, *args)
+    future.add_done_callback(partial(self._finished, on_done, on_error))
+    return future
+
+  def _finished(self, on_done, on_error, future):
+    if(future.cancelled()):
+      return
+    details = future.exception()
+    if(None != details):
+      if(on_error):
+        gui.call(on_error, details)
+      elif(isinstance(details, Warning)):
+        message(str(details), 'warn')
+      else:
+        message(str(details), 'error')
+    elif(on_done):
+      gui.call(on_done, future.result())
+
+  def shutdown(self, wait = False):
+    """ Stops accepting work. The work which is already submitted 
+    finishes in the background, or before this returns if `wait` is set.
+    """
+    self._executor.shutdown(wait = wait)
+
+class histogram:
+  """ Counts observed values in cumulative buckets, 
+  like a Prometheus histogram.
+  """
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.count = 0
+    self.sum = 0
+
+  def observe(self, value):
+    for bucket, upper_bound in enumerate(self.buckets):
+      if(value <= upper_bound):
+        self.counts[bucket] = self.counts[bucket] + 1
+    self.count = self.count + 1
+    self.sum = self.sum + value
+
+class metrics_registry:
+  """ Collects counters and latency histograms.
+
+  Every metric is identified by its name and its labels, the names 
+  get `prefix` in front of them. `render` returns all of them in the 
+  Prometheus text format.
+  """
+  prefix = 'praesidium_'
+  # Seconds, card commands take tens to hundreds of milliseconds
+  buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counters = {} # Name -> {labels: value}
+    self._histograms = {} # Name -> {labels: histogram}
+
+  def count(self, name, amount = 1, **labels):
+    """ Increases the counter `name` by `amount`.
+    """
+    key = tuple(sorted(labels.items()))
+    with self._lock:
+      counters = self._counters.setdefault(name, {})
+      counters[key] = counters.get(key, 0) + amount
+
+  def observe(self, name, value, **labels):
+    """ Adds `value` to the histogram `name`.
+    """
+    key = tuple(sorted(labels.items()))
+    with self._lock:
+      histograms = self._histograms.setdefault(name, {})
+      if(key not in histograms):
+        histograms[key] = histogram(self.buckets)
+      histograms[key].observe(value)
+
+  @contextmanager
+  def measure(self, name, **labels):
+    """ Measures how long the `with` block takes in the histogram 
+    `name`_seconds and counts failed blocks in `name`_errors_total.
+    """
+    start = monotonic()
+    try:
+      yield
+    except Exception:
+      self.count(name + '_errors_total', **labels)
+      raise
+    finally:
+      self.observe(name + '_seconds', monotonic() - start, **labels)
+
+  def render(self):
+    """ Returns all metrics in the Prometheus text format.
+    """
+    lines = []
+    with self._lock:
+      for name, counters in sorted(self._counters.items()):
+        lines.append('# TYPE ' + self.prefix + name + ' counter')
+        for key, value in sorted(counters.items()):
+          lines.append(self.prefix + name + self.format_labels(key) + ' ' + str(value))
+      for name, histograms in sorted(self._histograms.items()):
+        lines.append('# TYPE ' + self.prefix + name + ' histogram')
+        for key, values in sorted(histograms.items()):
+          for upper_bound, count in zip(values.buckets, values.counts):
+            lines.append(self.prefix + name + '_bucket' + self.format_labels(key + (('le', repr(float(upper_bound))),)) + ' ' + str(count))
+          lines.append(self.prefix + name + '_bucket' + self.format_labels(key + (('le', '+Inf'),)) + ' ' + str(values.count))
+          lines.append(self.prefix + name + '_sum' + self.format_labels(key) + ' ' + repr(values.sum))
+          lines.append(self.prefix + name + '_count' + self.format_labels(key) + ' ' + str(values.count))
+    return '\n'.join(lines) + '\n'
+
+  @staticmethod
+  def format_labels(key):
+    """ Formats the labels `key` as {name="value",...}.
+    """
+    if(not key):
+      return ''
+    return '{' + ','.join(
+      name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+      for name, value in key
+    ) + '}'
+
+  def dump(self, file_path):
+    """ Writes all metrics into `file_path`.
+
+    The file is replaced as a whole, so readers never see half of it.
+    """
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as metrics_file:
+      metrics_file.write(self.render())
+    os.replace(tmp_path, file_path)
+
+class metrics_request_handler(BaseHTTPRequestHandler):
+  """ Answers scrapes of the `metrics_server`.
+  """
+  def do_GET(self):
+    if(self.path not in ('/', '/metrics')):
+      self.send_error(404)
+      return
+    body = self.server.registry.render().encode()
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass # Scrapes would flood the messages
+
+class metrics_server:
+  """ Serves the metrics of `registry` for Prometheus on localhost.
+
+  Only connections from this machine are accepted.
+  """
+  def __init__(self, registry, port):
+    self._server = HTTPServer(('127.0.0.1', port), metrics_request_handler)
+    self._server.registry = registry
+    self._thread = threading.Thread(target = self._server.serve_forever, name = 'metrics', daemon = True)
+    self._thread.start()
+    message('Metrics served on http://127.0.0.1:%d/metrics', 'dev', port)
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+def start_metrics():
+  """ Starts the metrics endpoint and the metrics file, 
+  if they are configured.
+  """
+  global metrics_endpoint
+  if(metrics_port):
+    try:
+      metrics_endpoint = metrics_server(metrics, metrics_port)
+    except OSError as details:
+      message('Metrics endpoint not started: ' + str(details), 'warn')
+  if(metrics_file):
+    metrics_path = os.path.join(os.path.dirname(__file__), metrics_file)
+    scheduler.call_every('metrics file', metrics_interval, workers.submit, metrics.dump, metrics_path)
+
+def stop_metrics():
+  """ Stops the metrics endpoint and writes the metrics file 
+  one last time.
+  """
+  if(metrics_endpoint):
+    metrics_endpoint.stop()
+  if(metrics_file):
+    try:
+      metrics.dump(os.path.join(os.path.dirname(__file__), metrics_file))
+    except OSError as details:
+      message('Metrics file not saved: %s', 'dev', details)
+
+class http_client:
+  """ Sends HTTP requests over persistent connections.
+
+  Opening a new connection for every request costs a full TCP and 
+  TLS handshake. Instead, idle connections are kept open and reused 
+  for the next request to the same host. Failed requests are retried 
+  with a growing delay.
+  """
+  def __init__(self, timeout = default_wait, retries = 2, backoff = 0.5, pool_size = 2):
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.pool_size = pool_size
+    self._pools = {}
+    self._lock = threading.Lock()
+
+  def get(self, url, expected_errors = ()):
+    """ Returns the body of a GET request to `url`.
+    """
+    return self.request('GET', url, expected_errors = expected_errors)
+
+  def get_json(self, url, expected_errors = ()):
+    """ Returns the decoded json body of a GET request to `url`.
+    """
+    return json.loads(self.get(url, expected_errors))
+
+  def post(self, url, fields):
+    """ Returns the body of a POST request, which sends `fields` 
+    form encoded to `url`.
+    """
+    data = urlencode(fields).encode()
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    return self.request('POST', url, data, headers)
+
+  def request(self, method, url, data = None, headers = None, expected_errors = ()):
+    """ Sends a request and returns the (decompressed) body.
+
+    Broken connections and server errors of GET requests are retried 
+    `retries` times. Other requests are only retried if they could not 
+    be sent, so that e.g. a transaction is never broadcasted twice. 
+    Server errors whose body contains one of `expected_errors` are 
+    answers, not failures, and are not retried either. 
+    Any other status than 200 raises an exception.
+    """
+    url_parts = urlsplit(url)
+    host = (url_parts.scheme, url_parts.hostname, url_parts.port)
+    path = url_parts.path or '/'
+    if(url_parts.query):
+      path = path + '?' + url_parts.query
+    request_headers = {'Accept-Encoding': 'gzip', 'User-Agent': 'Praesidium'}
+    if(headers):
+      request_headers.update(headers)
+
+    attempt = 0
+    while(True):
+      # Only GET requests use idle connections, which the server may 
+      # have closed in the meantime, since only they can be retried 
+      # once they were sent.
+      connection, reused = self._get_connection(host, reuse = ('GET' == method))
+      sent = False
+      try:
+        with metrics.measure('http_request', method = method, host = url_parts.hostname):
+          connection.request(method, path, body = data, headers = request_headers)
+          sent = True
+          response = connection.getresponse()
+          body = response.read()
+      except (http.client.HTTPException, OSError) as details:
+        connection.close()
+        if((attempt >= self.retries) or (sent and ('GET' != method))):
+          raise
+        metrics.count('http_retries_total', host = url_parts.hostname)
+        message('Request to %s failed, retrying: %s', 'dev', url_parts.hostname, details)
+        if(reused):
+          attempt = attempt + 1
+          continue # The server closed the idle connection, no need to wait
+      else:
+        if(response.will_close):
+          connection.close()
+        else:
+          self._release_connection(host, connection)
+
+        metrics.count('http_responses_total', host = url_parts.hostname, status = response.status)
+        if('gzip' == response.getheader('Content-Encoding')):
+          body = gzip.decompress(body)
+        if(200 == response.status):
+          return body
+        text = body.decode(errors = 'replace')
+        expected = any(error in text for error in expected_errors)
+        if((attempt >= self.retries) or ('GET' != method) or (response.status < 500) or expected):
+          raise RuntimeError('HTTP ' + str(response.status) + ' ' + response.reason + ': ' + text[:200])
+        metrics.count('http_retries_total', host = url_parts.hostname)
+        message('Request to %s returned %d, retrying!', 'dev', url_parts.hostname, response.status)
+      sleep(self.backoff * (2 ** attempt))
+      attempt = attempt + 1
+
+  def _get_connection(self, host, reuse = True):
+    """ Returns an idle connection to `host` (unless `reuse` is 
+    `False`) or opens a new one.
+
+    Also returns whether the connection was reused.
+    """
+    with self._lock:
+      pool = self._pools.get(host)
+      if(reuse and pool):
+        return pool.pop(), True
+    scheme, hostname, port = host
+    if('https' == scheme):
+      return http.client.HTTPSConnection(hostname, port, timeout = self.timeout), False
+    elif('http' == scheme):
+      return http.client.HTTPConnection(hostname, port, timeout = self.timeout), False
+    else:
+      raise SpellingMistake()
+
+  def _release_connection(self, host, connection):
+    """ Keeps `connection` open for the next request to `host`.
+    """
+    with self._lock:
+      pool = self._pools.setdefault(host, [])
+      if(len(pool) < self.pool_size):
+        pool.append(connection)
+        return
+    connection.close()
+
+  def close(self):
+    """ Closes all idle connections.
+    """
+    with self._lock:
+      for pool in self._pools.values():
+        for connection in pool:
+          connection.close()
+      self._pools = {}
+
+class electrum_client:
+  """ Talks to an Electrum server via JSON-RPC.
+
+  Every message is one line of JSON. Requests and notifications share 
+  one connection, which is read by its own thread. Notifications are 
+  handed to `on_notification` on that thread, so it must not send 
+  requests itself. `on_close` is called if the server closes the 
+  connection.
+  """
+  def __init__(self, server, on_notification, on_close, timeout = default_wait):
+    host, port, protocol = server.rsplit(':', 2)
+    if(protocol not in ('s', 't')):
+      raise SpellingMistake()
+    self.host = host
+    self.port = int(port)
+    self.use_ssl = ('s' == protocol)
+    self.timeout = timeout
+    self.on_notification = on_notification
+    self.on_close = on_close
+    self._socket = None
+    self._closing = False
+    self._request_id = 0
+    self._pending = {} # Request id -> [answered event, response]
+    self._lock = threading.Lock()
+
+  def connect(self):
+    """ Connects to the server and agrees on a protocol version.
+    """
+    connection = socket.create_connection((self.host, self.port), timeout = self.timeout)
+    if(self.use_ssl):
+      connection = ssl.create_default_context().wrap_socket(connection, server_hostname = self.host)
+    connection.settimeout(None) # Notifications may take a long time
+    self._socket = connection
+    read_thread = threading.Thread(target = self._read, args = [connection.makefile('rb')])
+    read_thread.daemon = True
+    read_thread.start()
+    self.request('server.version', 'Praesidium', '1.4')
+
+  def request(self, method, *params):
+    """ Sends a request and waits for its result.
+    """
+    answer = [threading.Event(), None]
+    with self._lock:
+      if(None == self._socket):
+        raise RuntimeError('Not connected to the Electrum server!')
+      self._request_id = self._request_id + 1
+      request_id = self._request_id
+      self._pending[request_id] = answer
+      data = json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': list(params)})
+      self._socket.sendall(data.encode('utf-8') + b'\n')
+    if(not answer[0].wait(self.timeout)):
+      with self._lock:
+        self._pending.pop(request_id, None)
+      raise RuntimeError('Electrum server did not answer ' + method + '!')
+
+    response = answer[1]
+    if(None == response):
+      raise RuntimeError('Connection to the Electrum server lost!')
+    if(response.get('error')):
+      raise RuntimeError('Electrum server: ' + str(response['error']))
+    return response.get('result')
+
+  def _read(self, connection_file):
+    try:
+      for line in connection_file:
+        response = json.loads(line.decode('utf-8'))
+        if(None != response.get('id')):
+          with self._lock:
+            answer = self._pending.pop(response['id'], None)
+          if(answer):
+            answer[1] = response
+            answer[0].set()
+        elif('method' in response):
+          self.on_notification(response['method'], response.get('params', []))
+    except Exception as details:
+      message('Electrum connection: %s', 'dev', details)
+    finally:
+      with self._lock:
+        self._socket = None
+        for answer in self._pending.values():
+          answer[0].set() # Without response, so the request fails
+        self._pending.clear()
+      if(not self._closing):
+        self.on_close()
+
+  def close(self):
+    """ Closes the connection without calling `on_close`.
+    """
+    self._closing = True
+    with self._lock:
+      connection = self._socket
+    if(connection):
+      try:
+        connection.shutdown(socket.SHUT_RDWR)
+      except OSError:
+        pass
+      connection.close()
+
+class log_store:
+  """ Keeps the logs of all transactions in one SQLite database.
+
+  A log is added when a transaction is started and only ever grows 
+  afterwards. Logs are indexed by transaction ID, address and time, 
+  so a log can be found without reading all the others.
+  """
+  def __init__(self, db_path = None):
+    if(None == db_path):
+      directory_name = 'transaction logs'
+      tx_dir_path = os.path.join(os.path.dirname(__file__), directory_name)
+      os.makedirs(tx_dir_path, exist_ok=True)
+      db_path = os.path.join(tx_dir_path, 'transaction_logs.db')
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(db_path, check_same_thread = False)
+    self._db.row_factory = sqlite3.Row
+    with self._lock, self._db:
+      self._db.execute(
+          'CREATE TABLE IF NOT EXISTS logs ('
+        + 'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+        + 'created REAL NOT NULL, '
+        + 'btc_addr TEXT, '
+        + 'txid TEXT, '
+        + 'text TEXT NOT NULL)'
+        )
+      self._db.execute('CREATE INDEX IF NOT EXISTS logs_txid ON logs (txid)')
+      self._db.execute('CREATE INDEX IF NOT EXISTS logs_btc_addr ON logs (btc_addr, created)')
+      self._db.execute('CREATE INDEX IF NOT EXISTS logs_created ON logs (created)')
+
+  def add(self, btc_addr, txid, text, created = None):
+    """ Adds a log and returns its number.
+
+    `txid` is `None` if the transaction could not be built.
+    """
+    if(None == created):
+      created = time()
+    with self._lock, self._db:
+      cursor = self._db.execute(
+          'INSERT INTO logs (created, btc_addr, txid, text) VALUES (?, ?, ?, ?)',
+          (created, btc_addr, txid, text)
+        )
+    return cursor.lastrowid
+
+  def append(self, log_id, text, txid = None):
+    """ Adds `text` to the end of the log `log_id` and sets its 
+    `txid`, if given.
+    """
+    with self._lock, self._db:
+      self._db.execute(
+          'UPDATE logs SET text = text || ?, txid = coalesce(?, txid) WHERE id = ?',
+          (text, txid, log_id)
+        )
+
+  def get(self, log_id):
+    """ Returns the log `log_id` as a dictionary or `None`.
+    """
+    with self._lock:
+      row = self._db.execute('SELECT * FROM logs WHERE id = ?', (log_id,)).fetchone()
+    return dict(row) if row else None
+
+  def find(self, txid = None, btc_addr = None, since = None, until = None, limit = None):
+    """ Returns the logs which match all given filters, newest first.
+
+    `since` and `until` are timestamps as returned by `time()`. 
+    The log texts are left out, use `get` or `render` for them.
+    """
+    conditions = []
+    values = []
+    if(None != txid):
+      conditions.append('txid = ?')
+      values.append(txid)
+    if(None != btc_addr):
+      conditions.append('btc_addr = ?')
+      values.append(btc_addr)
+    if(None != since):
+      conditions.append('created >= ?')
+      values.append(since)
+    if(None != until):
+      conditions.append('created < ?')
+      values.append(until)
+    query = 'SELECT id, created, btc_addr, txid FROM logs'
+    if(conditions):
+      query = query + ' WHERE ' + ' AND '.join(conditions)
+    query = query + ' ORDER BY created DESC, id DESC'
+    if(None != limit):
+      query = query + ' LIMIT ?'
+      values.append(int(limit))
+    with self._lock:
+      rows = self._db.execute(query, values).fetchall()
+    return [dict(row) for row in rows]
+
+  def render(self, log_id):
+    """ Returns the log `log_id` as readable text, which shows how 
+    the transaction was built byte for byte.
+    """
+    entry = self.get(log_id)
+    if(None == entry):
+      raise Warning('There is no transaction log ' + str(log_id) + '!')
+    return (
+        'Log of Transaction '
+      + str(entry['id'])
+      + ' ('
+      + strftime('%Y-%m-%d %H:%M:%S', localtime(entry['created']))
+      + '):\n\n'
+      + entry['text']
+      )
+
+  def close(self):
+    """ Closes the database.
+    """
+    with self._lock:
+      self._db.close()
 
 class log:
-  """ Logs the transaction inside a text file.
+  """ Logs how a transaction is built.
 
   This can be used to help you learn how exactly a 
   transaction is build. It also helps you debug 
   a transaction incase it was build incorrectly or 
   doesnt broadcast.
+  The log is added to `tx_logs` with its first line and saved again 
+  after every section (which ends with an empty line), so the log of 
+  a transaction is kept even if Praesidium stops while the transaction 
+  is signed.
   """
-  def __init__(self):
-    directory_name = 'transaction logs'
-    tx_dir_path = os.path.join(os.path.dirname(__file__), directory_name)
-    if not os.path.exists(tx_dir_path):
-      os.makedirs(tx_dir_path, exist_ok=True)
+  def __init__(self, btc_addr = None):
+    self.btc_addr = btc_addr
+    self.created = time()
+    self.log_id = None
+    self._lines = []
+    self._lock = threading.Lock()
 
-    log_index = 1
-    tx_file_name = 'transaction_info_' + str(log_index) + '.txt'
-    tx_file_path = os.path.join(tx_dir_path, tx_file_name)
-    while(os.path.isfile(tx_file_path)):
-      log_index = log_index + 1
-      tx_file_name = 'transaction_info_' + str(log_index) + '.txt'
-      tx_file_path = os.path.join(tx_dir_path, tx_file_name)
+  def write_to_file(self, log_text = None):
+    """ Writes `log_text` into the log.
+
+    If no `log_text` then it makes a new line. The log is saved 
+    at its first and at every empty line.
+    """
+    with self._lock:
+      if(None != self._lines):
+        if(log_text):
+          self._lines.append(log_text)
+        self._lines.append('\n')
+        if((None == self.log_id) or (not log_text) or log_text.isspace()):
+          self._save()
+
+  def close(self, txid = None):
+    """ Saves the rest of the log in `tx_logs`.
+
+    `txid` is the ID of the transaction, if it was built.
+    """
+    with self._lock:
+      if(None != self._lines):
+        self._save(txid)
+        self._lines = None
+        message('Transaction log %d saved!', 'dev', self.log_id)
+
+  def _save(self, txid = None):
+    text = ''.join(self._lines)
+    self._lines = []
+    if(None == self.log_id):
+      self.log_id = tx_logs.add(self.btc_addr, txid, text, self.created)
+    elif(text or txid):
+      tx_logs.append(self.log_id, text, txid)
+
+class signing_session_store:
+  """ Keeps the signatures of transactions which are not completely 
+  signed yet in one SQLite database.
+
+  Every signature uses up the signature counters of the card, so each 
+  signature is saved as soon as the card made it. If the card is removed 
+  or a command fails halfway through a transaction, signing the same 
+  transaction again only signs the inputs which are left.
+  """
+  max_age = 7 * 24 * 60 * 60 # Unfinished sessions are forgotten after a week
 
-    self.log_file = open(tx_file_path,'w+')
-    self.write_to_file('Log of Transaction ' + str(log_index) + ':\n')
+  def __init__(self, db_path = None):
+    if(None == db_path):
+      directory_name = 'transaction logs'
+      tx_dir_path = os.path.join(os.path.dirname(__file__), directory_name)
+      os.makedirs(tx_dir_path, exist_ok=True)
+      db_path = os.path.join(tx_dir_path, 'signing_sessions.db')
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(db_path, check_same_thread = False)
+    with self._lock, self._db:
+      self._db.execute(
+          'CREATE TABLE IF NOT EXISTS signatures ('
+        + 'session TEXT NOT NULL, '
+        + 'input INTEGER NOT NULL, '
+        + 'digest BLOB NOT NULL, '
+        + 'signature BLOB NOT NULL, '
+        + 'created REAL NOT NULL, '
+        + 'PRIMARY KEY (session, input))'
+        )
+      self._db.execute('DELETE FROM signatures WHERE created < ?', (time() - self.max_age,))
 
-  def write_to_file(self, log_text = None):
-    """ Writes `log_text` into the text file.
+  def open(self, btc_addr, unsigned_tx):
+    """ Returns the signing session of `unsigned_tx` spending from 
+    `btc_addr`, with all signatures saved so far.
+    """
+    session_id = hashlib.sha256(btc_addr.encode() + unsigned_tx).hexdigest()
+    with self._lock:
+      rows = self._db.execute(
+          'SELECT input, digest, signature FROM signatures WHERE session = ?', 
+          (session_id,)
+        ).fetchall()
+    signatures = {row[0]: (bytes(row[1]), bytes(row[2])) for row in rows}
+    return signing_session(self, session_id, signatures)
+
+  def save(self, session_id, script, digest, signature):
+    """ Saves the signature of input `script`.
+    """
+    with self._lock, self._db:
+      self._db.execute(
+          'INSERT OR REPLACE INTO signatures (session, input, digest, signature, created) VALUES (?, ?, ?, ?, ?)',
+          (session_id, script, digest, signature, time())
+        )
 
-    If no `log_text` then it makes a new line.
+  def delete(self, session_id, script = None):
+    """ Deletes the signature of input `script` or, without `script`, 
+    all signatures of the session.
     """
-    if(self.log_file):
-      if(log_text):
-        self.log_file.write(log_text)
-      self.log_file.write('\n')
+    with self._lock, self._db:
+      if(None == script):
+        self._db.execute('DELETE FROM signatures WHERE session = ?', (session_id,))
+      else:
+        self._db.execute('DELETE FROM signatures WHERE session = ? AND input = ?', (session_id, script))
 
   def close(self):
-    """ Closes the text file.
+    """ Closes the database.
+    """
+    with self._lock:
+      self._db.close()
+
+class signing_session:
+  """ The saved signatures of one transaction, see `signing_session_store`.
+  """
+  def __init__(self, store, session_id, signatures):
+    self.store = store
+    self.session_id = session_id
+    self.signatures = signatures # Input -> (digest, signature)
+
+  def get_signature(self, script, digest):
+    """ Returns the saved signature of input `script`, if it signs `digest`.
+
+    A signature of another digest is of no use anymore and gets deleted.
     """
-    if(self.log_file):
-      self.log_file.close()
-      self.log_file = None
+    if(script not in self.signatures):
+      return None
+    saved_digest, signature = self.signatures[script]
+    if(saved_digest != digest):
+      message('Saved signature of input %d is outdated!', 'dev', script + 1)
+      del self.signatures[script]
+      self.store.delete(self.session_id, script)
+      return None
+    return signature
+
+  def save(self, script, digest, signature):
+    self.signatures[script] = (digest, signature)
+    self.store.save(self.session_id, script, digest, signature)
+
+  def finish(self):
+    """ Forgets all signatures once the transaction is signed.
+    """
+    self.signatures = {}
+    self.store.delete(self.session_id)
+
+class lazy_hex:
+  """ Turns `data` into a hex string only when it is formatted.
+
+  Pass it as an argument to `message` instead of calling `.hex()`, 
+  so that nothing gets converted for messages which are not shown.
+  """
+  __slots__ = ('data',)
+
+  def __init__(self, data):
+    self.data = data
+
+  def __str__(self):
+    return self.data.hex()
+
+class message_formatter(logging.Formatter):
+  """ Puts the prefix of the message mode in front of each message.
+  """
+  prefixes = {
+    logging.DEBUG: 'DEV: ',
+    logging.INFO: 'Status: ',
+    logging.WARNING: 'WARNING: ',
+    logging.ERROR: 'ERROR: '
+  }
+
+  def format(self, record):
+    return self.prefixes.get(record.levelno, '') + record.getMessage()
 
-def message(text, mode = None):
-  """ Sends `text` to the standard output of the system and
-  to the status bar of the application.
+class event_buffer(logging.Handler):
+  """ Keeps the latest `size` messages in memory.
 
-  It would be better write `str(text)` here instead of 
-  everywhere in the program where the `message` function gets 
-  used, but this was not done to debug more easily.
+  The messages are only formatted when they are read, so keeping 
+  them costs next to nothing.
   """
-  if((False == developer) and ('dev' == mode)):
-    return # No dev messages should be sent if dev mode if off
+  def __init__(self, size = event_buffer_size):
+    super(event_buffer, self).__init__()
+    self.setFormatter(message_formatter())
+    self._records = deque(maxlen = size)
 
-  if('dev' != mode):
-    timer.stop() # Cancel any previous delayed messages
+  def emit(self, record):
+    self._records.append(record)
 
-  if((True == developer) and ('dev' == mode)):
-    text = 'DEV: ' + text
-  elif('warn' == mode):
-    text = 'WARNING: ' + text
-    ui.status_bar.setStyleSheet('background-color: rgb(245, 198, 49)')
+  def get_events(self, level = logging.DEBUG):
+    """ Returns the kept messages of at least `level`, oldest first.
+    """
+    return [
+      strftime('%H:%M:%S ', localtime(record.created)) + self.format(record)
+      for record in list(self._records)
+      if(record.levelno >= level)
+    ]
+
+  def clear(self):
+    self._records.clear()
+
+def create_diagnostics(events):
+  """ Sets up the logger behind `message`, which writes every 
+  message to the standard output and into `events`.
+  """
+  diagnostics = logging.getLogger('praesidium')
+  diagnostics.setLevel(logging.DEBUG)
+  diagnostics.propagate = False
+  for handler in list(diagnostics.handlers):
+    diagnostics.removeHandler(handler)
+  console = logging.StreamHandler(sys.stdout)
+  console.setFormatter(message_formatter())
+  diagnostics.addHandler(console)
+  diagnostics.addHandler(events)
+  return diagnostics
+
+def message(text, mode = None, *args):
+  """ Sends `text` to the standard output of the system, to 
+  `events` and to the status bar of the application.
+
+  `text` is only formatted with `args` (`%` style, like `logging`) if the 
+  message is shown. Dev messages are dropped right away if dev mode is 
+  off, so pass values which are expensive to turn into text, such as 
+  bytes wrapped in `lazy_hex`, as `args`.
+
+  Can be used from any thread, the status bar is always 
+  changed by the GUI thread.
+  """
+  if('dev' == mode):
+    if(developer):
+      diagnostics.debug(text, *args)
+    return # Dev messages are not shown in the status bar
+
+  timer.stop() # Cancel any previous delayed messages
+
+  if('warn' == mode):
+    diagnostics.warning(text, *args)
+    prefix = 'WARNING: '
+    style = 'background-color: rgb(245, 198, 49)'
     timer.start(default_wait, message, 'Waiting...')
   elif('error' == mode):
-    text = 'ERROR: ' + text
-    ui.status_bar.setStyleSheet('background-color: rgb(227, 0, 52)')
+    diagnostics.error(text, *args)
+    prefix = 'ERROR: '
+    style = 'background-color: rgb(227, 0, 52)'
     timer.start(default_wait, message, 'Waiting...')
   else:
-    text = 'Status: ' + text
-    ui.status_bar.setStyleSheet('background-color: rgb(118, 159, 59);')
+    diagnostics.info(text, *args)
+    prefix = 'Status: '
+    style = 'background-color: rgb(118, 159, 59);'
+
+  if(args):
+    text = text % args
+  status_updates.show(prefix + text, style)
+
+class status_bar_updater:
+  """ Shows messages in the status bar.
 
-  print(text)
-  if('dev' != mode):
+  The status bar is changed at most once every `interval` seconds, 
+  messages which arrive in between replace each other and only the 
+  latest one gets shown.
+  """
+  interval = 0.05 # Seconds, about every third frame
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._pending = None
+    self._scheduled = False
+    self._shown_at = 0
+    self._style = None
+
+  def show(self, text, style):
+    """ Shows `text` with the background `style` as soon as allowed.
+    """
+    with self._lock:
+      self._pending = (text, style)
+      if(self._scheduled):
+        return
+      self._scheduled = True
+      delay = max(0, self._shown_at + self.interval - monotonic())
+    gui.call(QTimer.singleShot, int(delay * 1000), self._flush)
+
+  def _flush(self):
+    with self._lock:
+      text, style = self._pending
+      self._pending = None
+      self._scheduled = False
+      self._shown_at = monotonic()
+    if(style != self._style):
+      ui.status_bar.setStyleSheet(style) # Restyling is expensive, so only on change
+      self._style = style
     ui.status_bar.setText(text)
 
 ## Card / reader related classes and functions:
 class reader_info:
-  """ Manages the reader and holds the reader object.
+  """ Manages one reader and holds the reader object.
+
+  This is the session of the reader: it also knows which card is 
+  on the reader and has a worker of its own, which sends the card 
+  its commands. The worker has two threads, so that a keypair scan 
+  does not hold back other commands, but only one command at a time 
+  reaches the card.
   """
-  def __init__(self):
+  def __init__(self, name = None):
+    self.name = name or reader_name
     self.reader = None
     self.card_connected = False
+    self.card_id = None # See keypair_cache.get_card_id
+    # Only one command can be sent to the card at a time
+    self.lock = threading.RLock()
+    self.worker = worker_pool(max_workers = 2)
 
   def get_reader(self):
     """ Identifies reader via a specified name and saves it as 
@@ -154,7 +1134,7 @@ class reader_info:
     """
     if(self.reader == None):
       try:
-        self.reader = blocksec2go.find_reader(reader_name)
+        self.reader = blocksec2go.find_reader(self.name)
         message('Found the specified reader and a card!')
         return self.reader
       except Exception as details:
@@ -170,13 +1150,68 @@ class reader_info:
     else:
       return self.reader
 
-def activate_card():
-  """ Enables communication to the Blockchain Security 2Go card.
+  def disconnect(self):
+    """ Forgets the card and the reader object after the card was removed.
+    """
+    self.card_connected = False
+    self.card_id = None
+    self.reader = None
+
+class reader_pool:
+  """ Holds the sessions of all readers.
+
+  Jobs for a card are routed to the worker of the reader which 
+  holds the card, so that several cards work at the same time.
+  """
+  def __init__(self, names):
+    self.sessions = [reader_info(name) for name in names]
+
+  def get_connected(self):
+    """ Returns the sessions which hold a Blockchain Security 2Go card.
+    """
+    return [session for session in self.sessions if(session.card_connected)]
+
+  def find_card(self, card_id):
+    """ Returns the session of the reader which holds the card `card_id`.
+
+    Cards without keypairs have no identity, for them (`card_id` 
+    `None`) the reader of the shown card is returned.
+    """
+    if(None == card_id):
+      return reader if(reader.card_connected) else None
+    for session in self.get_connected():
+      if(card_id == session.card_id):
+        return session
+    return None
+
+  def submit(self, card_id, function, *args, on_done = None, on_error = None):
+    """ Runs `function` on the worker of the reader which holds the 
+    card `card_id`, its session is passed as `session`.
+    """
+    session = self.find_card(card_id)
+    if(None == session):
+      raise Warning('Please put the card back on a reader!')
+    return session.worker.submit(partial(function, session = session), *args, on_done = on_done, on_error = on_error)
+
+  def shutdown(self, wait = False):
+    """ Stops the workers of all readers, see `worker_pool.shutdown`.
+    """
+    for session in self.sessions:
+      session.worker.shutdown(wait = False)
+    if(wait):
+      for session in self.sessions:
+        session.worker.shutdown(wait = True)
+
+def activate_card(session = None):
+  """ Enables communication to the Blockchain Security 2Go card 
+  on `session` (the reader of the shown card by default).
   
   Also ensures that all other cards are rejected.
   """
+  session = session or reader
   try:
-    blocksec2go.select_app(reader.reader)
+    with session.lock, metrics.measure('card_command', command = 'select_app'):
+      blocksec2go.select_app(session.reader)
     message('Found / reset Blockchain Security 2Go card!', 'dev')
     return True
   except Exception as details:
@@ -189,106 +1224,411 @@ def generate_keypair():
   Keep in mind that you can not specify the keypair slot.
   This is managed by the card itself.
   """
-  try:
-    key_id = blocksec2go.generate_keypair(reader.reader)
-    if(valid_key(key_id)):
-      message('Generated a new keypair at slot ' + str(key_id))
-      key_button = ui.window.findChild(QPushButton, 'key_' + str(key_id))
-      key_button.setStyleSheet('border: 1px solid;')
-      key_button.setEnabled(True)
-    else:
-      raise RuntimeError('Generated keypair has become obsolete!')
-  except Exception as details:
-    message(str(details), 'error')
+  reader.worker.submit(new_keypair, reader, on_done = keypair_generated)
+
+def new_keypair(session = None):
+  """ Lets the card generate a new keypair and returns its slot.
+
+  Runs on a worker thread.
+  """
+  session = session or reader
+  with session.lock, metrics.measure('card_command', command = 'generate_keypair'):
+    key_id = blocksec2go.generate_keypair(session.reader)
+  if(valid_key(key_id, session)):
+    return key_id
+  else:
+    raise RuntimeError('Generated keypair has become obsolete!')
+
+def keypair_generated(key_id):
+  """ Shows the keypair generated by `new_keypair`.
+  """
+  message('Generated a new keypair at slot ' + str(key_id))
+  ui.keypairs.set_key(key_id, True)
 
-def get_keypair_info(key_id):
+def get_keypair_info(key_id, session = None):
   """ Gets keypair information from the Blockchain Security 2Go card.
   
   This may either be the counters specifying how many times you can 
   generate a signature or the public key on a specified keypair.
   """
+  session = session or reader
   try:
-    return blocksec2go.get_key_info(reader.reader, key_id)
+    with session.lock, metrics.measure('card_command', command = 'get_key_info'):
+      return blocksec2go.get_key_info(session.reader, key_id)
   except Exception as details:
     message(str(details), 'error')
 
-def valid_key(key_id):
+def valid_key(key_id, session = None):
   """ Checks the specified keypair for its existence and validity.
   """
+  session = session or reader
   try:
-    return blocksec2go.is_key_valid(reader.reader, key_id)
+    with session.lock, metrics.measure('card_command', command = 'is_key_valid'):
+      return blocksec2go.is_key_valid(session.reader, key_id)
   except Exception as details:
     message(str(details), 'error')
 
 def verify_pin():
   """ Verifies a PIN value on the Blockchain Security 2Go card.
   """
-  try:
-    status = blocksec2go.verify_pin(reader.reader, ui.pin.text())
-    if((True == status) and (isinstance(status, bool))):
-      message('OK - Verified!')
-      ui.select_pin_button.setStyleSheet('background-color: rgb(118, 159, 59);border: none;')
-      ui.select_pin_button.setCursor(Qt.ForbiddenCursor)
-    elif(0 != status):
-      message(str(status) + ' tries left!', 'error')
-      ui.select_pin_button.setStyleSheet('background-color: rgb(227, 0, 52);border: none;')
-      ui.select_pin_button.setCursor(Qt.ArrowCursor)
-    else:
-      message('PIN locked!', 'error')
-      ui.select_pin_button.setStyleSheet('background-color: rgb(227, 0, 52);border: none;')
-      ui.select_pin_button.setCursor(Qt.ForbiddenCursor)
-      ui.select_pin_button.setEnabled(False)
-  except Exception as details:
-    message(str(details), 'error')
+  reader.worker.submit(check_pin, ui.pin.text(), reader, on_done = show_pin_status)
+
+def check_pin(pin, session = None):
+  """ Sends `pin` to the card and returns its answer.
 
-def generate_signature(key_id, hashed_tx):
+  Runs on a worker thread.
+  """
+  session = session or reader
+  with session.lock, metrics.measure('card_command', command = 'verify_pin'):
+    return blocksec2go.verify_pin(session.reader, pin)
+
+def show_pin_status(status):
+  """ Shows the answer of `check_pin` on the PIN button.
+  """
+  if((True == status) and (isinstance(status, bool))):
+    message('OK - Verified!')
+    ui.select_pin_button.setStyleSheet('background-color: rgb(118, 159, 59);border: none;')
+    ui.select_pin_button.setCursor(Qt.ForbiddenCursor)
+  elif(0 != status):
+    message(str(status) + ' tries left!', 'error')
+    ui.select_pin_button.setStyleSheet('background-color: rgb(227, 0, 52);border: none;')
+    ui.select_pin_button.setCursor(Qt.ArrowCursor)
+  else:
+    message('PIN locked!', 'error')
+    ui.select_pin_button.setStyleSheet('background-color: rgb(227, 0, 52);border: none;')
+    ui.select_pin_button.setCursor(Qt.ForbiddenCursor)
+    ui.select_pin_button.setEnabled(False)
+
+def generate_signature(key_id, hashed_tx, session = None):
   """ Generates a signature with keypair `key_id` using `hashed_tx`.
 
   The returned signature is in the DER encoded format.
   No exception catching on purpose!
   """
-  return blocksec2go.generate_signature(reader.reader, int(key_id), hashed_tx)
+  session = session or reader
+  with session.lock, metrics.measure('card_command', command = 'generate_signature'):
+    return blocksec2go.generate_signature(session.reader, int(key_id), hashed_tx)
+
+def start_card_monitor():
+  """ Imports the Blockchain Security 2Go library and starts 
+  watching the readers for cards.
+
+  Importing the library takes a while on weaker systems, which 
+  is why this is only done after the window is shown.
+  """
+  global blocksec2go, observer, cardmonitor, cardobserver
+  if(simulate_card):
+    import card_simulator as blocksec2go
+    observer = blocksec2go.observer
+    for session in readers.sessions: # A card on every reader
+      blocksec2go.insert_card(session.name, blocksec2go.simulated_card(latency = blocksec2go.realistic_latency))
+  else:
+    import blocksec2go
+    from blocksec2go.comm import observer
+
+  cardmonitor, cardobserver = observer.start()
+  blocksec2go.add_callback(connect = card_connect, disconnect = card_disconnect)
 
 def card_connect(self):
   """ Callback for when the Blockchain Security 2Go card is inserted.
   
   This triggeres always when any card is connected to any reader!
+  Every reader without a card is checked. The first card is shown, 
+  the keypairs of further cards are verified in the background.
+  It runs on the thread of the card observer, so the UI is only 
+  changed through the GUI thread.
   """
-  if(not reader.reader): 
-    if(None == reader.get_reader()):
-      message('Please check reader and card!', 'warn')
-    else:
-      # Do not combine 2 if statements because 2nd statement always resets PIN.
-      if(not reader.card_connected): # 1st if: Actually checks if card is connected.
-        if(activate_card()): # 2nd if: Makes sure connected card is Blockchain Security 2Go card.
-          try:
-            app.setOverrideCursor(Qt.WaitCursor)
-            ui.verify_key_buttons()
-            reader.card_connected = True
-            message('Card connected!')
-            ui.switch_to_frame('keypair')
-          except Exception as details:
-            message(str(details), 'error')
-          finally:
-            app.changeOverrideCursor(Qt.ArrowCursor)
-            threading.Timer(0.5, app.restoreOverrideCursor).start() # Reset Cursor
+  found = False
+  for session in readers.sessions:
+    if(not session.reader): 
+      if(None != session.get_reader()):
+        found = True
+        # Do not combine 2 if statements because 2nd statement always resets PIN.
+        if(not session.card_connected): # 1st if: Actually checks if card is connected.
+          if(activate_card(session)): # 2nd if: Makes sure connected card is Blockchain Security 2Go card.
+            if(not reader.card_connected): # No card shown yet
+              session.card_connected = True
+              show_card(session)
+            else:
+              session.card_connected = True
+              message('Card connected on ' + session.name + '!')
+              session.worker.submit(scan_card, session)
+  if((not found) and (not reader.card_connected)):
+    message('Please check reader and card!', 'warn')
 
 def card_disconnect(self):
   """ Callback for when the Blockchain Security 2Go card is removed.
   
   This triggeres always when any card is removed from any reader!
+  The library does not tell which reader it was, so every reader 
+  with a card is checked by `check_card` on its own worker.
+  Like `card_connect` it runs on the thread of the card observer.
   """
-  if((reader.reader)):
-    if(activate_card()):
-      message('Another card was removed! Please reconfirm your PIN!', 'warn')
-      ui.card.reset_pin()
-    else:
-      reader.card_connected = False
-      message('Card removed!')
-      reader.reader = None
-      ui.switch_to_frame('no_card')
-      ui.flush_key_buttons()
-      ui.clear_card_frame()
+  for session in readers.sessions:
+    if(session.reader):
+      session.worker.submit(check_card, session)
+
+def check_card(session):
+  """ Forgets the card on `session` if it was removed. If it was 
+  the shown card, the card on another reader is shown.
+
+  Runs on the worker of the reader.
+  """
+  if(session.card_connected and card_present(session)):
+    return
+  connected = session.card_connected
+  gui.call(ui.card.drop_transactions, session.card_id)
+  session.disconnect()
+  if(session is reader):
+    hide_card()
+    message('Card removed!')
+    for other in readers.get_connected():
+      other.worker.submit(show_card, other)
+      break
+  elif(connected):
+    message('Card removed from ' + session.name + '!')
+
+def card_present(session):
+  """ Returns whether the card is still on `session`.
+
+  Unlike `activate_card` this keeps the verified PIN, so that a 
+  transaction which is signed on the card is not interrupted.
+  """
+  try:
+    with session.lock, metrics.measure('card_command', command = 'is_key_valid'):
+      blocksec2go.is_key_valid(session.reader, 1)
+    return True
+  except Exception:
+    return False
+
+def show_card(session):
+  """ Shows the keypairs of the card on `session`, whose reader 
+  becomes the reader of the shown card.
+
+  Runs on the thread of the card observer or on the worker of the reader.
+  """
+  global reader
+  reader = session
+  try:
+    gui.call(app.setOverrideCursor, Qt.WaitCursor)
+    ui.verify_key_buttons()
+    session.card_id = key_cache.card_id
+    message('Card connected!')
+    gui.call(ui.switch_to_frame, 'keypair')
+    gui.call(ui.update_reader_button)
+    gui.call(ui.card.show_signed) # Transaction signed meanwhile
+  except Exception as details:
+    message(str(details), 'error')
+  finally:
+    gui.call(app.changeOverrideCursor, Qt.ArrowCursor)
+    scheduler.call_later(0.5, gui.call, app.restoreOverrideCursor) # Reset Cursor
+
+def hide_card():
+  """ Stops showing the card of `reader`.
+  """
+  ui.keypairs.scanner.stop()
+  key_cache.reset()
+  gui.call(ui.switch_to_frame, 'no_card')
+  gui.call(ui.flush_key_buttons)
+  gui.call(ui.clear_card_frame)
+  gui.call(ui.portfolio.clear)
+
+def switch_reader(session):
+  """ Shows the card on `session` instead of the shown card.
+
+  Transactions keep being signed, see `card.generate_transaction`.
+  """
+  if(session is reader):
+    return
+  if(not session.card_connected):
+    raise Warning('There is no card on ' + session.name + '!')
+  hide_card()
+  session.worker.submit(show_card, session)
+
+def scan_card(session):
+  """ Verifies all keypairs of the card on `session` for the keypair 
+  cache, so that the card can be shown right away later on.
+
+  Runs on the worker of the reader.
+  """
+  session.card_id = keypair_cache.get_card_id(session)
+  if(None == session.card_id):
+    return
+  key_list = []
+  for key_id in range(1, ui.keypairs.get_key_id_max() + 1):
+    validity = valid_key(key_id, session)
+    if(None == validity):
+      return # Card removed, see card_disconnect
+    key_list.append(bool(validity))
+  key_cache.set_key_list(key_list, session.card_id)
+  message('Verified all keypairs on %s!', 'dev', session.name)
+
+class keypair_cache:
+  """ Remembers which keypair slots are valid on every known card 
+  and their public keys.
+
+  Verifying all keypairs takes one command per slot, which is slow 
+  on weaker systems. A card is identified by the public key of its 
+  first keypair, since keypairs can not be deleted or changed once 
+  they are generated. The cache is saved as a json file.
+  """
+  def __init__(self, cache_path = None):
+    if(None == cache_path):
+      cache_name = 'keypair_cache.json'
+      cache_path = os.path.join(os.path.dirname(__file__), cache_name)
+    self.cache_path = cache_path
+    self.card_id = None
+    self._cards = {}
+    self._lock = threading.Lock()
+    self.load()
+
+  def load(self):
+    """ Loads the cache file, if it exists.
+    """
+    try:
+      with open(self.cache_path, 'r') as cache_file:
+        self._cards = json.load(cache_file)
+    except Exception as details:
+      self._cards = {}
+      if(os.path.exists(self.cache_path)):
+        message('Keypair cache unreadable: %s', 'dev', details)
+
+  def save(self):
+    """ Saves the cache file.
+
+    The file gets replaced as a whole so that an interrupted 
+    write can not corrupt the cache.
+    """
+    tmp_path = self.cache_path + '.tmp'
+    try:
+      with self._lock:
+        with open(tmp_path, 'w') as cache_file:
+          json.dump(self._cards, cache_file)
+        os.replace(tmp_path, self.cache_path)
+    except Exception as details:
+      message('Keypair cache not saved: %s', 'dev', details)
+
+  @staticmethod
+  def get_card_id(session = None):
+    """ Returns the identity of the card on `session` (the reader of the 
+    shown card by default), the hash of the public key of keypair 1.
+
+    Returns `None` if the card has no keypairs yet.
+    """
+    if(valid_key(1, session)):
+      global_counter, counter, key = get_keypair_info(1, session)
+      return hashlib.sha256(key).hexdigest()
+    return None
+
+  def identify(self):
+    """ Identifies the shown card by the public key of 
+    keypair 1.
+
+    Returns `None` if the card has no keypairs yet.
+    """
+    self.card_id = self.get_card_id()
+    if(self.card_id):
+      message('Card identity: %s', 'dev', self.card_id)
+    return self.card_id
+
+  def get_key_list(self, key_id_max):
+    """ Returns the cached validity of all keypairs on the 
+    identified card or `None` if the card is unknown.
+    """
+    if('valid' not in self._cards.get(self.card_id, {})):
+      return None
+    valid_keys = self._cards[self.card_id]['valid']
+    return [(key_id + 1) in valid_keys for key_id in range(key_id_max)]
+
+  def set_key_list(self, key_list, card_id = None):
+    """ Saves the validity of all keypairs on the card `card_id`, 
+    the identified card by default.
+    """
+    card_id = card_id or self.card_id
+    if(card_id):
+      valid_keys = [key_id + 1 for key_id in range(len(key_list)) if key_list[key_id]]
+      with self._lock:
+        self._cards.setdefault(card_id, {})['valid'] = valid_keys
+      self.save()
+
+  def get_public_key(self, key_id):
+    """ Returns the cached public key of keypair `key_id` on the 
+    identified card or `None` if it is not cached.
+    """
+    public_keys = self._cards.get(self.card_id, {}).get('public_keys', {})
+    if(str(key_id) not in public_keys):
+      return None
+    return bytes.fromhex(public_keys[str(key_id)])
+
+  def set_public_keys(self, public_keys):
+    """ Saves the public keys of the identified card, given as a 
+    dictionary of keypair -> public key.
+    """
+    if(self.card_id and public_keys):
+      card = self._cards.setdefault(self.card_id, {})
+      cached_keys = card.setdefault('public_keys', {})
+      for key_id, public_key in public_keys.items():
+        cached_keys[str(key_id)] = public_key.hex()
+      self.save()
+
+  def reset(self):
+    """ Forgets the identified card, but keeps its cached keypairs.
+    """
+    self.card_id = None
+
+class key_scanner(QObject):
+  """ Verifies all keypairs one after another in the background.
+
+  Every result is sent to the UI right away, so keypairs can be 
+  selected before the whole card has been verified. Each scan gets 
+  its own number so that results of an aborted scan are ignored.
+  """
+  key_verified = Signal(int, int, bool)
+  scan_finished = Signal(int)
+  scan_failed = Signal(int, str)
+
+  def __init__(self, key_id_max):
+    super(key_scanner, self).__init__()
+    self.key_id_max = key_id_max
+    self.scan_id = 0
+    self._abort = threading.Event()
+
+  def start(self, session = None):
+    """ Aborts any running scan and starts a new one of the card 
+    on `session` (the reader of the shown card by default).
+
+    Returns the number of the new scan.
+    """
+    session = session or reader
+    self.stop()
+    self._abort = threading.Event()
+    session.worker.submit(self.run, self.scan_id, self._abort, session)
+    return self.scan_id
+
+  def stop(self):
+    """ Aborts the running scan before its next keypair.
+
+    Results which the aborted scan already sent are ignored.
+    """
+    self._abort.set()
+    self.scan_id = self.scan_id + 1
+
+  def run(self, scan_id, abort, session = None):
+    """ Verifies keypair after keypair until all are done or 
+    the scan gets aborted.
+    """
+    for key_id in range(1, self.key_id_max + 1):
+      if(abort.is_set()):
+        return
+      validity = valid_key(key_id, session)
+      if(abort.is_set()):
+        return
+      if(None == validity):
+        self.scan_failed.emit(scan_id, 'Please reinsert card into card reader!')
+        return
+      message('Verified key %d', 'dev', key_id)
+      self.key_verified.emit(scan_id, key_id, bool(validity))
+    self.scan_finished.emit(scan_id)
 
 ## UI related classes and functions:
 class UI:
@@ -300,6 +1640,7 @@ class UI:
     self.keypairs = keys(self)
     self.card = card(self)
     self.confirm = confirmation(self)
+    self.portfolio = portfolio(self)
 
     self.blockchain_poll = None
 
@@ -309,8 +1650,23 @@ class UI:
   @classmethod
   def load(ui_cls):
     """ Loads the application UI via a fixed path.
+
+    Parsing `mainwindow.ui` at runtime is slow on weaker systems. 
+    If `ui_mainwindow.py` was compiled from it (see README) and is 
+    up to date, the UI is built by that module instead.
     """
     ui_file_loc = os.path.join(os.path.dirname(__file__), 'mainwindow.ui')
+    compiled_ui_loc = os.path.join(os.path.dirname(__file__), 'ui_mainwindow.py')
+    if(os.path.isfile(compiled_ui_loc) and (os.path.getmtime(compiled_ui_loc) >= os.path.getmtime(ui_file_loc))):
+      try:
+        from ui_mainwindow import Ui_MainWindow
+        window = QMainWindow()
+        Ui_MainWindow().setupUi(window)
+        return ui_cls(window)
+      except ImportError:
+        pass # Fall back to mainwindow.ui
+
+    from PySide2.QtUiTools import QUiLoader
     ui_file = QFile(ui_file_loc)
     ui_file.open(QFile.ReadOnly)
 
@@ -344,6 +1700,7 @@ class UI:
     self.keys_frame = self.window.findChild(QFrame, 'key')
     self.card_frame = self.window.findChild(QFrame, 'card')
     self.confirmation_frame = self.window.findChild(QFrame, 'confirmation')
+    self.portfolio_frame = self.window.findChild(QFrame, 'portfolio')
     self.hide_mainframes()
 
     # Set keypair_frame
@@ -358,18 +1715,50 @@ class UI:
     self.select_key_button = self.window.findChild(QPushButton, 'select_key')
     self.select_key_button.clicked.connect(self.select_keypair)
 
+    self.show_portfolio_button = self.window.findChild(QPushButton, 'show_portfolio')
+
+    # Only shown with several readers, chooses the card which is shown
+    self.reader_button = QPushButton(self.keys_frame)
+    self.reader_button.setGeometry(QRect(20, 0, 400, 40))
+    self.reader_button.setFont(QFont('Arial', 12))
+    self.reader_button.setStyleSheet('background-color: rgb(146, 130, 133);border: none;')
+    self.reader_menu = QMenu(self.reader_button)
+    self.reader_menu.aboutToShow.connect(self.update_reader_menu)
+    self.reader_button.setMenu(self.reader_menu)
+    self.reader_button.setVisible(len(readers.sessions) > 1)
+    self.update_reader_button()
+
     # Set card_frame
+    # Converts the amount and fee once typing pauses
+    self.conversion_timer = QTimer(self.window)
+    self.conversion_timer.setSingleShot(True)
+    self.conversion_timer.setInterval(150) # Milliseconds
+    self.conversion_timer.timeout.connect(self.update_conversion)
+
     self.target_address = self.window.findChild(QLineEdit, 'tar_addr')
     self.amount = self.window.findChild(QLineEdit, 'amount')
-    self.amount.textChanged.connect(self.update_poll)
+    self.amount.textChanged.connect(self.schedule_conversion)
     self.amount.setValidator(QIntValidator())
     self.amount_converter = self.window.findChild(QLabel, 'amount_result')
     self.fee = self.window.findChild(QLineEdit, 'fee')
-    self.fee.textChanged.connect(self.update_poll)
+    self.fee.textChanged.connect(self.schedule_conversion)
     self.fee.setValidator(QIntValidator())
     self.fee_converter = self.window.findChild(QLabel, 'fee_result')
     self.card.set_default_amount_and_fee()
 
+    self.payments = payment_queue()
+    self.target_address_layout = self.window.findChild(QHBoxLayout, 'target_adress_layout')
+    self.target_address.setMaxLength(90) # Long enough for every bech32 address
+    self.queue_payment_button = self.card.add_queue_button('+', 30)
+    self.queue_payment_button.setToolTip('Add payment to the queue')
+    self.queue_payment_button.clicked.connect(self.card.queue_payment)
+    self.queue_info = self.card.add_queue_button('', 110)
+    self.queue_menu = QMenu(self.queue_info)
+    self.queue_menu.addAction('Import payments (CSV)', self.card.import_payments)
+    self.queue_menu.addAction('Clear queue', self.card.clear_payments)
+    self.queue_info.setMenu(self.queue_menu)
+    self.card.update_queue_info()
+
     self.qrcode_holder = self.window.findChild(QLabel, 'qrcode_image')
     self.qrcode_description = self.window.findChild(QLabel, 'btc_addr')
     self.global_counter_info = self.window.findChild(QLabel, 'global_counter')
@@ -394,6 +1783,12 @@ class UI:
     self.deny_button = self.window.findChild(QPushButton, 'deny')
     self.confirm.init_frame()
 
+    # Set portfolio_frame
+    self.portfolio_layout = self.window.findChild(QVBoxLayout, 'portfolio_layout')
+    self.refresh_portfolio_button = self.window.findChild(QPushButton, 'refresh_portfolio')
+    self.close_portfolio_button = self.window.findChild(QPushButton, 'close_portfolio')
+    self.portfolio.init_frame()
+
   def hide_mainframes(self):
     """ Hides all the window frames.
 
@@ -404,6 +1799,7 @@ class UI:
     self.keys_frame.hide()
     self.card_frame.hide() 
     self.confirmation_frame.hide()
+    self.portfolio_frame.hide()
 
   def switch_to_frame(self, frame):
     """ Switches to `frame` window. 
@@ -421,11 +1817,27 @@ class UI:
       message('Ready to use!')
     elif('confirm' == frame):
       self.confirmation_frame.show()
+    elif('portfolio' == frame):
+      self.portfolio_frame.show()
     else:
       raise SpellingMistake()
 
     timer.start(default_wait, message, 'Waiting...')
 
+  def update_reader_button(self):
+    """ Shows the reader of the shown card on the reader button.
+    """
+    self.reader_button.setText('Reader: ' + reader.name)
+
+  def update_reader_menu(self):
+    """ Lists every reader with a card in the reader menu.
+    """
+    self.reader_menu.clear()
+    for session in readers.get_connected():
+      action = self.reader_menu.addAction(session.name, partial(gui.call, switch_reader, session))
+      action.setCheckable(True)
+      action.setChecked(session is reader)
+
   def verify_key_buttons(self):
     """ Verifies all keypairs and updates the key buttons accordingly.
     """
@@ -443,29 +1855,50 @@ class UI:
     creating the BTC address or signing a transaction.
     """
     key_id = self.key_id.text()
-    if(('' != key_id) and (1 <= int(key_id) <= self.keypairs.get_key_id_max()) and (valid_key(int(key_id)))):
-      message('Keypair ' + key_id + ' selected!')
-      key_id = int(key_id)
-      global_counter, counter, key = get_keypair_info(key_id)
-      btc_addr = pub_key_to_BTC_Addr(key)
-      self.card.create_qrcode(btc_addr)
-      self.card.set_key_info(key_id, global_counter, counter)
-      self.card.set_pub_key(key)
-      threading.Thread(target = self.start_poll, args = [btc_addr]).start()
-      self.switch_to_frame('card')
+    if(('' != key_id) and (1 <= int(key_id) <= self.keypairs.get_key_id_max())):
+      reader.worker.submit(self.load_keypair, int(key_id), reader, on_done = self.show_keypair)
     else:
       message('Please select a valid keypair!', 'warn')
       timer.start(default_wait, message, 'Waiting...')
 
+  def load_keypair(self, key_id, session = None):
+    """ Reads keypair `key_id` from the card and derives its address.
+
+    Runs on a worker thread.
+    """
+    if(not valid_key(key_id, session)):
+      raise Warning('Please select a valid keypair!')
+    if(None == key_cache.card_id):
+      (session or reader).card_id = key_cache.identify()
+    global_counter, counter, key = get_keypair_info(key_id, session)
+    btc_addr = pub_key_to_BTC_Addr(key)
+    return key_id, global_counter, counter, key, btc_addr
+
+  def show_keypair(self, keypair):
+    """ Shows the keypair loaded by `load_keypair` in the card frame.
+    """
+    key_id, global_counter, counter, key, btc_addr = keypair
+    message('Keypair ' + str(key_id) + ' selected!')
+    self.keypairs.set_key(key_id, True) # Cache might not know this keypair yet
+    self.card.create_qrcode(btc_addr)
+    self.card.set_key_info(key_id, global_counter, counter)
+    self.card.set_pub_key(key)
+    self.balance.setText('Please wait!')
+    self.amount_converter.setText((' ') * 45)
+    self.fee_converter.setText((' ') * 45)
+    workers.submit(self.start_poll, btc_addr)
+    self.switch_to_frame('card')
+
   def clear_card_frame(self):
     """ Clears / resets the card_frame. 
     """
     self.card.reset()
 
   def start_poll(self, btc_addr):
-    self.balance.setText('Please wait!')
-    self.amount_converter.setText((' ') * 45)
-    self.fee_converter.setText((' ') * 45)
+    utxos.reconcile_in_background(btc_addr) # So the first transaction can start right away
+    ticker.start()
+    if(self.blockchain_poll):
+      self.blockchain_poll.stop() # Of the previous keypair
     try:
       self.blockchain_poll = blockchain_info_poll(btc_addr)
     except Warning as details:
@@ -473,8 +1906,113 @@ class UI:
     except Exception as details:
       message(str(details), 'error')
 
-  def update_poll(self):
-    self.blockchain_poll.update_currency_rate()
+  def schedule_conversion(self):
+    """ Converts the amount and fee once typing pauses, instead of 
+    on every single keystroke.
+    """
+    self.conversion_timer.start()
+
+  def update_conversion(self):
+    """ Converts the amount and fee into Euro with the last known 
+    exchange rate.
+    """
+    if(self.blockchain_poll):
+      try:
+        self.blockchain_poll.update_conversion()
+      except Warning as details:
+        message(str(details), 'warn')
+
+class key_grid(QWidget):
+  """ Draws all keypair buttons of the keypair frame in one go.
+
+  The state of every keypair is kept in a single bytearray, so 
+  repainting all keypairs only costs one paint event instead of 
+  restyling hundreds of buttons.
+  """
+  INVALID = 0
+  VALID = 1
+
+  def __init__(self, key_id_max, row_max, column_max, clicked):
+    super(key_grid, self).__init__()
+    self.states = bytearray(key_id_max)
+    self._row_max = row_max
+    self._column_max = column_max
+    self._clicked = clicked
+    self._cell_max = 28
+    self._spacing = 4
+    self.setFont(QFont('Source Sans Pro', 11))
+    self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+  def set_state(self, key_id, state):
+    """ Sets the state of a single keypair and repaints only its button.
+    """
+    if(self.states[key_id - 1] != state):
+      self.states[key_id - 1] = state
+      self.update(self.cell_rect(key_id))
+
+  def set_states(self, key_list):
+    """ Sets the states of all keypairs and repaints the grid once.
+    """
+    for key_id in range(len(self.states)):
+      self.states[key_id] = self.VALID if key_list[key_id] else self.INVALID
+    self.update()
+
+  def clear(self):
+    """ Marks all keypairs as invalid.
+    """
+    self.states[:] = bytes(len(self.states))
+    self.update()
+
+  def cell_size(self):
+    """ Returns the button size which fits into the current widget size.
+    """
+    column_width = self.width() // self._column_max
+    row_height = self.height() // self._row_max
+    return max(1, min(self._cell_max, column_width - self._spacing, row_height - self._spacing))
+
+  def cell_rect(self, key_id):
+    """ Returns the rectangle of the button of keypair `key_id`.
+    """
+    size = self.cell_size()
+    row, column = divmod(key_id - 1, self._column_max)
+    return QRect(column * (size + self._spacing), row * (size + self._spacing), size, size)
+
+  def key_at(self, position):
+    """ Returns the keypair whose button is at `position` or `None`.
+    """
+    pitch = self.cell_size() + self._spacing
+    column = position.x() // pitch
+    row = position.y() // pitch
+    key_id = row * self._column_max + column + 1
+    if((column < self._column_max) and (1 <= key_id <= len(self.states))):
+      if(self.cell_rect(key_id).contains(position)):
+        return key_id
+    return None
+
+  def paintEvent(self, event):
+    """ Paints all buttons which lie in the area that needs repainting.
+    """
+    painter = QPainter(self)
+    painter.setFont(self.font())
+    for key_id in range(1, len(self.states) + 1):
+      rect = self.cell_rect(key_id)
+      if(not event.rect().intersects(rect)):
+        continue
+      if(self.VALID == self.states[key_id - 1]):
+        painter.setPen(QColor(0, 0, 0))
+        painter.drawRect(rect.adjusted(0, 0, -1, -1))
+      else:
+        painter.fillRect(rect, QColor(146, 130, 133))
+        painter.setPen(QColor(120, 120, 120))
+      painter.drawText(rect, Qt.AlignCenter, str(key_id))
+    painter.end()
+
+  def mousePressEvent(self, event):
+    """ Selects the clicked keypair, if it is valid.
+    """
+    key_id = self.key_at(event.pos())
+    if(key_id and (self.VALID == self.states[key_id - 1])):
+      self._clicked(key_id)
 
 class keys:
   """ Manages buttons on the keypair frame.
@@ -484,23 +2022,12 @@ class keys:
     self._row_max = 11
     self._column_max = 26
     self.__key_id_max = 0xFD
+    self.grid = None
 
-  @staticmethod
-  def paint_button(window, key_id, key_list = None):
-    """ Paints the keypair UI buttons depending on 
-    their validity .
-    """
-    key_button = window.findChild(QPushButton, 'key_' + str(key_id + 1))
-    if(key_list):
-      if(key_list[key_id]):
-        key_button.setStyleSheet('border: 1px solid;')
-        key_button.setEnabled(True)
-      else:
-        key_button.setStyleSheet('background-color: rgb(146, 130, 133); border: none;')
-        key_button.setEnabled(False)
-    else:
-      key_button.setStyleSheet('background-color: rgb(146, 130, 133); border: none;')
-      key_button.setEnabled(False)
+    self.scanner = key_scanner(self.__key_id_max)
+    self.scanner.key_verified.connect(self.scan_result)
+    self.scanner.scan_finished.connect(self.scan_done)
+    self.scanner.scan_failed.connect(self.scan_error)
 
   def get_key_id_max(self):
     """ Returns the maximum number of keypair slots on the 
@@ -509,69 +2036,92 @@ class keys:
     return self.__key_id_max
 
   def generate_buttons(self):
-    """ Generates `__key_id_max` buttons in the keypair frame.
+    """ Generates the grid of `__key_id_max` buttons in the keypair frame.
     
     The structural layout of the buttons can be changed 
     easily by adjusting `_row_max` and `_column_max`.
 
     All of the values are found in the initializer method.
     """
-    for row in range(0, self._row_max):
-      for column in range(0, self._column_max):
-        key_id = self._column_max * row + column + 1
-        if(self.__key_id_max >= key_id):
-          key_button = QPushButton('Key_' + str(key_id))
-          key_button.setObjectName('key_' + str(key_id))
-          key_button.setText(str(key_id))
-          key_button.clicked.connect(partial(self.ui.key_id.setText, str(key_id)))
-          key_button.setMinimumSize(QSize(28, 28))
-          key_button.setMaximumSize(QSize(28, 28))
-          key_button.setStyleSheet('background-color: rgb(146, 130, 133); border: none;')
-          key_button.setFont(QFont('Source Sans Pro', 11))
-          key_button.setEnabled(False)
-          self.ui.keys_grid.addWidget(key_button, row, column)
+    self.grid = key_grid(self.__key_id_max, self._row_max, self._column_max, self.click_button)
+    self.grid.setObjectName('key_grid')
+    self.ui.keys_grid.addWidget(self.grid, 0, 0)
+
+  def click_button(self, key_id):
+    """ Enters the keypair of a clicked button into the keypair field.
+    """
+    self.ui.key_id.setText(str(key_id))
+
+  def set_key(self, key_id, validity):
+    """ Updates a single keypair button and the keypair cache.
+
+    Does not talk to the card, the cache is only updated once 
+    the card has been identified.
+    """
+    state = key_grid.VALID if validity else key_grid.INVALID
+    if(self.grid.states[key_id - 1] == state):
+      return
+    self.grid.set_state(key_id, state)
+    if(None != key_cache.card_id):
+      key_cache.set_key_list(self.grid.states)
 
   def verify(self, window):
     """ Verifies all keypairs and updates the key buttons accordingly.
+
+    Keypairs of known cards are painted from the keypair cache right 
+    away. All keypairs are then verified in the background and 
+    painted as soon as they are verified.
     """
+    key_list = None
+    if(key_cache.identify()):
+      key_list = key_cache.get_key_list(self.__key_id_max)
+    if(key_list):
+      message('Loaded keypairs from cache!', 'dev')
+      gui.call(self.grid.set_states, key_list)
+    else:
+      gui.call(self.grid.clear)
+
     message('Verifying all keypairs!', 'warn')
-    key_list = [None] * self.__key_id_max
-    for key_id in range(0, self.__key_id_max):
-      validity = valid_key(key_id + 1)
-      if(validity):
-        key_list[key_id] = True
-      elif(False == validity):
-        key_list[key_id] = False
-      else:
-        raise RuntimeError('Please reinsert card into card reader!')
-      message('Verified key ' + str(key_id + 1), 'dev')
-  
-    for key_id in range(0, self.__key_id_max):
-      threading.Thread(target = self.paint_button, args = (window, key_id, key_list)).start()
-    message('Done verifying all keypairs!', 'warn')
-    window.update()
+    self.scanner.start()
+
+  def scan_result(self, scan_id, key_id, validity):
+    """ Paints a keypair button as soon as its keypair is verified.
+    """
+    if(scan_id == self.scanner.scan_id):
+      self.grid.set_state(key_id, key_grid.VALID if validity else key_grid.INVALID)
+
+  def scan_done(self, scan_id):
+    """ Saves the verified keypairs once all of them are verified.
+    """
+    if(scan_id == self.scanner.scan_id):
+      key_cache.set_key_list(self.grid.states)
+      message('Done verifying all keypairs!', 'warn')
+
+  def scan_error(self, scan_id, details):
+    """ Shows why the keypairs could not be verified.
+    """
+    if(scan_id == self.scanner.scan_id):
+      message(details, 'error')
 
   def flush(self, window):
     """ Flushes all keypair buttons to avoid graphical errors.
     """
     self.ui.key_id.setText('')
-    for key_id in range(0, self.__key_id_max):
-      threading.Thread(target = self.paint_button, args = (window, key_id)).start()
-    window.update()
+    self.grid.clear()
 
 class card:
   """ Manages buttons and text fields in the card frame.
   """
   def __init__(self, ui):
     self.ui = ui
-    img_name = 'BTC_Address.png'
-    self.img_path = os.path.join(os.path.dirname(__file__), img_name)
+    self.qrcodes = {} # Address -> QPixmap, oldest first
+    self.qrcode_cache_size = 32
     
     self.default_amount = None
     self.default_fee = None
     self.__pub_key = None
     self.blockchain = None
-    self.logger = None
+    self.transactions = [] # Not yet broadcasted, see generate_transaction
 
   def set_default_amount_and_fee(self):
     """ Saves init amount and fee so that they can be 
@@ -594,54 +2144,227 @@ class card:
     self.ui.global_counter_info.setText(str(global_counter))
     self.ui.counter_info.setText(str(counter))
 
+  def add_queue_button(self, text, width):
+    """ Adds a button for the payment queue next to the target address.
+    """
+    queue_button = QPushButton(text)
+    queue_button.setFont(QFont('Arial', 12))
+    queue_button.setFixedWidth(width)
+    queue_button.setStyleSheet('background-color: rgb(146, 130, 133);border: none;')
+    self.ui.target_address_layout.insertWidget(self.ui.target_address_layout.count() - 1, queue_button) # In front of the spacer
+    return queue_button
+
+  def update_queue_info(self):
+    """ Shows how many payments are queued.
+    """
+    self.ui.queue_info.setText('Queue: ' + str(len(self.ui.payments)))
+    self.ui.queue_info.setToolTip(str(self.ui.payments.get_total()) + ' Satoshi')
+
+  def queue_payment(self):
+    """ Adds the payment in the target address and amount fields 
+    to the payment queue.
+    """
+    try:
+      self.ui.payments.add(self.ui.target_address.text(), self.ui.amount.text() or 0)
+      self.update_queue_info()
+      message('Payment ' + str(len(self.ui.payments)) + ' added to the queue!')
+    except Warning as details:
+      message(str(details), 'warn')
+    except Exception as details:
+      message(str(details), 'error')
+
+  def import_payments(self):
+    """ Adds all payments of a chosen csv file to the payment queue.
+    """
+    csv_path, _ = QFileDialog.getOpenFileName(self.ui.window, 'Import payments', '', 'CSV files (*.csv);;All files (*)')
+    if(not csv_path):
+      return
+    try:
+      payment_number = self.ui.payments.import_csv(csv_path)
+      self.update_queue_info()
+      message('Imported ' + str(payment_number) + ' payments!')
+    except Warning as details:
+      message(str(details), 'warn')
+    except Exception as details:
+      message(str(details), 'error')
+
+  def clear_payments(self):
+    """ Removes all payments from the payment queue.
+    """
+    self.ui.payments.clear()
+    self.update_queue_info()
+    message('Payment queue cleared!')
+
   def create_qrcode(self, btc_addr):
-    """ Creates qrcode by using a bitcoin address.
+    """ Shows the qrcode of a bitcoin address.
 
-    The qrcode is also saved as an image as long as the 
-    card is connected and a key is selected.
+    Qrcodes which were already shown are reused, new ones 
+    are rendered on a worker thread.
     """
-    qrcode_img = qrcode.make(btc_addr)
-    qrcode_img.save(self.img_path)
     self.ui.qrcode_holder.setObjectName('qrcode')
-    self.ui.qrcode_holder.setPixmap(QPixmap(self.img_path).scaledToWidth(300))
     self.ui.qrcode_description.setText(btc_addr)
+    if(btc_addr in self.qrcodes):
+      self.ui.qrcode_holder.setPixmap(self.qrcodes[btc_addr])
+      message('Reused qrcode!', 'dev')
+    else:
+      self.ui.qrcode_holder.clear()
+      workers.submit(self.render_qrcode, btc_addr, on_done = partial(self.show_qrcode, btc_addr))
+
+  @staticmethod
+  def render_qrcode(btc_addr, width = 300):
+    """ Renders the qrcode of `btc_addr` into an image which is 
+    at most `width` pixels wide.
+
+    Every module of the qrcode becomes a square of whole pixels, 
+    so the image stays sharp without being scaled.
+    """
+    import qrcode
+
+    qr = qrcode.QRCode()
+    qr.add_data(btc_addr)
+    qr.make(fit = True)
+    matrix = qr.get_matrix() # Including the white border
+    box_size = max(1, width // len(matrix))
+    size = len(matrix) * box_size
+
+    dark = bytes([0x00]) * box_size
+    light = bytes([0xFF]) * box_size
+    pixels = b''.join(
+        b''.join(dark if module else light for module in row) * box_size
+        for row in matrix
+      )
+    return QImage(pixels, size, size, size, QImage.Format_Grayscale8).copy() # Copy, so the image owns its pixels
+
+  def show_qrcode(self, btc_addr, qrcode_image):
+    """ Caches the qrcode rendered by `render_qrcode` and shows it, 
+    unless another address was selected meanwhile.
+    """
+    if(len(self.qrcodes) >= self.qrcode_cache_size):
+      del self.qrcodes[next(iter(self.qrcodes))]
+    self.qrcodes[btc_addr] = QPixmap.fromImage(qrcode_image)
+    if(self.ui.qrcode_description.text() == btc_addr):
+      self.ui.qrcode_holder.setPixmap(self.qrcodes[btc_addr])
     message('Created qrcode!', 'dev')
 
   def remove_qrcode(self):
-    """ Removes qrcode elements and deletes image from 
-    the system. 
+    """ Removes qrcode elements. 
     """
     self.ui.qrcode_holder.clear()
     self.ui.qrcode_description.clear()
-    if(os.path.exists(self.img_path)):
-      os.remove(self.img_path)
-      message('Removed qrcode!', 'dev')
 
   def generate_transaction(self):
     """ Generates a transaction that is ready to be 
     broadcasted.
+
+    Each card has one transaction at a time, but the transactions 
+    of cards on different readers are signed at the same time. 
+    A signed transaction is confirmed once its card is shown.
     """
     btc_addr = self.ui.qrcode_description.text()
     try:
-      message('Generating transaction!')
-      ui.switch_to_frame('confirm')
-      self.logger = log()
-      tx = transaction(btc_addr, self.logger)
-      signed_tx = tx.make(self.__pub_key)
-      message('Broadcastable Transaction:', 'dev')
-      message(signed_tx.hex(), 'dev')
-      ui.confirm.set_transaction(signed_tx)
-      ui.confirm.transaction_done()
+      payments = self.get_payments()
+      fee = int(self.ui.fee.text())
+      if(self.get_transaction(key_cache.card_id)):
+        raise Warning('The last transaction of this card is not broadcasted yet!')
+      from_queue = (0 < len(self.ui.payments))
+      if(from_queue and any(pending.from_queue for pending in self.transactions)):
+        raise Warning('The queued payments are already paid on another reader!')
     except Warning as details:
-      ui.switch_to_frame('card')
       message(str(details), 'warn')
-      self.logger.write_to_file('Warning occured: ' + str(details))
-      self.logger.close()
+      return
     except Exception as details:
-      ui.switch_to_frame('card')
       message(str(details), 'error')
-      self.logger.write_to_file('Error occured: ' + str(details))
-      self.logger.close()
+      return
+    pending = pending_transaction(key_cache.card_id, btc_addr, payments, from_queue)
+    try:
+      readers.submit(
+          pending.card_id, self.make_transaction, pending, fee, self.ui.key_id_info.text(), self.__pub_key,
+          on_done = self.transaction_made,
+          on_error = partial(self.transaction_failed, pending)
+        )
+      self.transactions.append(pending)
+      message('Generating transaction!')
+    except Warning as details:
+      self.transaction_failed(pending, details)
+
+  def get_transaction(self, card_id):
+    """ Returns the transaction of the card `card_id` which is not 
+    broadcasted yet, if there is one.
+    """
+    for pending in self.transactions:
+      if((None != card_id) and (card_id == pending.card_id)):
+        return pending
+    return None
+
+  def get_payments(self):
+    """ Returns the queued payments, or the one in the input fields.
+    """
+    if(len(self.ui.payments)):
+      return self.ui.payments.get_payments()
+    return [(self.ui.target_address.text(), int(self.ui.amount.text()))]
+
+  def make_transaction(self, pending, fee, key_id, pub_key, session = None):
+    """ Builds and signs the transaction `pending` on the worker of 
+    the reader which holds the card.
+    """
+    pending.reader_name = session.name
+    pending.tx = transaction(pending.btc_addr, pending.logger, pending.payments, fee, key_id, session)
+    pending.signed_tx = pending.tx.make(pub_key)
+    return pending
+
+  def transaction_made(self, pending):
+    """ Shows the transaction built by `make_transaction`, or tells 
+    which card to show if it is not shown.
+    """
+    message('Broadcastable Transaction:', 'dev')
+    message('%s', 'dev', lazy_hex(pending.signed_tx))
+    if(pending not in self.transactions):
+      return # Card removed meanwhile, see drop_transactions
+    if(pending.card_id == key_cache.card_id):
+      self.show_signed()
+    else:
+      message('Transaction signed on ' + pending.reader_name + '! Please switch to its card to confirm it.')
+
+  def transaction_failed(self, pending, details):
+    """ Forgets the transaction `pending` if `make_transaction` failed.
+    """
+    if(pending in self.transactions):
+      self.transactions.remove(pending)
+    if(isinstance(details, Warning)):
+      message(str(details), 'warn')
+      pending.logger.write_to_file('Warning occured: ' + str(details))
+    else:
+      message(str(details), 'error')
+      pending.logger.write_to_file('Error occured: ' + str(details))
+    pending.logger.close()
+
+  def show_signed(self):
+    """ Shows the signed transaction of the shown card for confirmation.
+    """
+    pending = self.get_transaction(key_cache.card_id)
+    if(pending and pending.signed_tx):
+      ui.switch_to_frame('confirm')
+      ui.confirm.set_transaction(pending)
+      ui.confirm.transaction_done()
+
+  def drop_transactions(self, card_id):
+    """ Forgets the signed transaction of the removed card `card_id`.
+
+    A transaction which is still signed fails by itself.
+    """
+    pending = self.get_transaction(card_id)
+    if(pending and pending.signed_tx):
+      self.transactions.remove(pending)
+      pending.logger.close()
+      if(pending is ui.confirm.pending):
+        ui.confirm.pending = None
+
+  def show_counters(self, session, key_id, global_counter, counter):
+    """ Shows the counters of a keypair which just signed, if it 
+    is the selected keypair.
+    """
+    if((session is reader) and (str(key_id) == self.ui.key_id_info.text())):
+      self.set_key_info(key_id, global_counter, counter)
 
   def reset_pin(self):
     """ Resets the PIN field and the PIN button.
@@ -662,6 +2385,23 @@ class card:
     self.ui.amount.setText(self.default_amount)
     self.ui.fee.setText(self.default_fee)
 
+class pending_transaction:
+  """ A transaction of one card, from generating it until it is 
+  broadcasted or dropped.
+
+  Transactions of cards on different readers are signed at the same 
+  time, so each has its own log and is shown once it is signed.
+  """
+  def __init__(self, card_id, btc_addr, payments, from_queue):
+    self.card_id = card_id
+    self.btc_addr = btc_addr
+    self.payments = payments
+    self.from_queue = from_queue # Pays the queued payments
+    self.logger = log(btc_addr)
+    self.reader_name = None # See card.make_transaction
+    self.tx = None
+    self.signed_tx = None
+
 class confirmation:
   """ Manages buttons and text fields in the confirmation frame.
   """
@@ -669,10 +2409,13 @@ class confirmation:
     self.ui = ui
 
     self.broadcastable_tx = None
+    self.tx_info = None
     self.payment_info = None
+    self.payments = None
     self.info_label = None
     self.transaction_browser = None
     self.btc_addr = None
+    self.pending = None # Shown `pending_transaction`
 
   def init_frame(self):
     """ Sets the buttons and hides them since they will 
@@ -683,25 +2426,31 @@ class confirmation:
     self.ui.confirm_layout.addWidget(self.info_label)
     self.ui.confirm_layout.addWidget(self.transaction_browser)
     self.ui.confirm_button.clicked.connect(self.broadcast_tx)
-    self.ui.deny_button.clicked.connect(partial(self.ui.switch_to_frame, 'card'))
+    self.ui.deny_button.clicked.connect(self.deny_tx)
     self.ui.confirm_button.hide()
     self.ui.deny_button.hide()
 
-  def set_transaction(self, transaction):
-    """ Sets the broadcastable transaction which will be pushed to the mempool.
-    """
-    self.broadcastable_tx = transaction
-
-  def set_payment_info(self, amount, fee, change):
-    """ Sets the payment info that is shown in the confirmation frame.
+  def set_transaction(self, pending):
+    """ Sets the signed `pending_transaction` which will be pushed to 
+    the mempool, and the payment info that is shown for it.
     """
+    amount, fee, change = pending.tx.tx_helper.payment_info
+    self.pending = pending
+    self.broadcastable_tx = pending.signed_tx
+    self.tx_info = pending.tx
     self.payment_info = (str(amount), str(fee), str(change))
+    self.payments = pending.tx.tx_helper.get_payments()
+    self.btc_addr = pending.btc_addr
 
   def show_information(self):
     """ Shows information about the transaction.
     """
-    self.btc_addr = self.ui.qrcode_description.text()
-    target_addr = self.ui.target_address.text()
+    if(1 == len(self.payments)):
+      target_addr = self.payments[0][0]
+    else:
+      target_addr = str(len(self.payments)) + ' payments'
+      for btc_addr, amount in self.payments:
+        target_addr = target_addr + '\n  ' + btc_addr + ': ' + str(amount)
 
     address = (
         'Own Address: '
@@ -745,16 +2494,9 @@ class confirmation:
     """
     try:
       ui.switch_to_frame('card')
-      push_url = 'https://blockchain.info/pushtx'
-      if(self.broadcastable_tx):
-        transaction = {'tx' : self.broadcastable_tx.hex()}
-        data = urlencode(transaction).encode()
-        req =  Request(push_url, data = data)
-        urlopen(req)
-
-        # Also update balance in card window
-        if(self.btc_addr):
-          ui.blockchain_poll.update_currency_rate(self.btc_addr)
+      if(self.pending):
+        workers.submit(self.push_tx, self.broadcastable_tx, self.tx_info, on_done = partial(self.tx_pushed, self.pending))
+        self.forget_tx()
       else:
         raise Warning('No broadcastable transaction!')
     except Warning as details:
@@ -762,26 +2504,287 @@ class confirmation:
     except Exception as details:
       message(str(details), 'error')
 
+  def deny_tx(self):
+    """ Drops the shown transaction without broadcasting it.
+    """
+    ui.switch_to_frame('card')
+    self.forget_tx()
+
+  def forget_tx(self):
+    """ Lets the card of the shown transaction make a new one.
+    """
+    if(self.pending in ui.card.transactions):
+      ui.card.transactions.remove(self.pending)
+    self.pending = None
+    self.tx_info = None
+
+  def push_tx(self, broadcastable_tx, tx_info):
+    """ Sends the transaction to the server on a worker thread.
+    """
+    push_url = blockchain_url + '/pushtx'
+    transaction = {'tx' : broadcastable_tx.hex()}
+    http_session.post(push_url, transaction)
+
+    # Spend from the change right away, the server takes a while
+    if(tx_info):
+      utxos.apply_transaction(tx_info.btc_addr, tx_info.spent_outputs, tx_info.change_outputs)
+      utxos.reconcile_in_background(tx_info.btc_addr)
+
+  def tx_pushed(self, pending, result):
+    """ Updates the UI once `push_tx` is done with `pending`.
+    """
+    message('Transaction broadcasted!')
+
+    # The queued payments have been paid
+    if(pending.from_queue):
+      ui.payments.clear()
+      ui.card.update_queue_info()
+
+    # Also update balance in card window, if the keypair is still selected
+    if(ui.blockchain_poll and (pending.btc_addr == ui.blockchain_poll.btc_addr)):
+      workers.submit(ui.blockchain_poll.update_currency_rate, pending.btc_addr)
+
+class portfolio:
+  """ Manages the portfolio frame, which shows the balances of all 
+  valid keypairs on the card and their total.
+
+  Public keys come from the keypair cache, so only keypairs which 
+  are not cached yet are read from the card. Balances are requested 
+  in batches with only a few requests at the same time, and shown as 
+  soon as they arrive.
+  """
+  batch_size = 20 # Addresses per request
+  max_requests = 3 # Requests at the same time
+
+  def __init__(self, ui):
+    self.ui = ui
+
+    self.refresh_id = 0
+    self.rows = {} # Address -> table row
+    self.balances = {} # Address -> balance
+    self._batches = []
+    self._requests = 0
+    self.total_label = None
+    self.table = None
+
+  def init_frame(self):
+    """ Initializes the portfolio frame.
+    """
+    self.total_label = QLabel()
+    self.total_label.setFont(QFont('Source Sans Pro', 12))
+    self.total_label.setWordWrap(True)
+    self.total_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+    self.table = QTableWidget(0, 3)
+    self.table.setHorizontalHeaderLabels(['Keypair', 'Address', 'Balance [Satoshi]'])
+    self.table.verticalHeader().hide()
+    self.table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+    self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeToContents)
+    self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+    self.table.setFont(QFont('Source Sans Pro', 10))
+    self.ui.portfolio_layout.addWidget(self.total_label)
+    self.ui.portfolio_layout.addWidget(self.table)
+    self.ui.show_portfolio_button.clicked.connect(self.show)
+    self.ui.refresh_portfolio_button.clicked.connect(self.refresh)
+    self.ui.close_portfolio_button.clicked.connect(partial(self.ui.switch_to_frame, 'keypair'))
+
+  def show(self):
+    """ Opens the portfolio frame with up to date balances.
+    """
+    self.ui.switch_to_frame('portfolio')
+    self.refresh()
+
+  def clear(self):
+    """ Clears the portfolio and ignores all results which are 
+    still on their way.
+    """
+    self.refresh_id = self.refresh_id + 1
+    self.rows = {}
+    self.balances = {}
+    self._batches = []
+    self._requests = 0
+    self.table.setRowCount(0)
+    self.total_label.setText('')
+
+  def refresh(self):
+    """ Reloads the balances of all valid keypairs.
+    """
+    states = self.ui.keypairs.grid.states
+    key_ids = [key_id + 1 for key_id in range(len(states)) if states[key_id]]
+    self.clear()
+    if(not key_ids):
+      message('There are no keypairs on this card!', 'warn')
+      return
+    try:
+      readers.submit(key_cache.card_id, self.load_addresses, self.refresh_id, key_ids, on_done = self.addresses_loaded)
+    except Warning as details:
+      message(str(details), 'warn')
+      return
+    message('Loading portfolio!')
+    self.total_label.setText('Please wait!')
+
+  def load_addresses(self, refresh_id, key_ids, session = None):
+    """ Derives the address of every keypair in `key_ids`.
+
+    Runs on the worker of the reader which holds the shown card. 
+    Every address is shown right away.
+    """
+    if(None == key_cache.card_id):
+      key_cache.identify()
+    btc_addrs = []
+    new_public_keys = {}
+    try:
+      for key_id in key_ids:
+        if(refresh_id != self.refresh_id):
+          break # Outdated, e.g. because the card was removed
+        public_key = key_cache.get_public_key(key_id)
+        if(None == public_key):
+          keypair_info = get_keypair_info(key_id, session)
+          if(None == keypair_info):
+            raise Warning('Please reinsert card into card reader!')
+          global_counter, counter, public_key = keypair_info
+          new_public_keys[key_id] = public_key
+        btc_addr = pub_key_to_BTC_Addr(public_key)
+        btc_addrs.append(btc_addr)
+        gui.call(self.add_row, refresh_id, key_id, btc_addr)
+    finally:
+      key_cache.set_public_keys(new_public_keys)
+    return refresh_id, btc_addrs
+
+  def add_row(self, refresh_id, key_id, btc_addr):
+    """ Adds the keypair `key_id` to the table.
+    """
+    if(refresh_id != self.refresh_id):
+      return
+    row = self.table.rowCount()
+    self.table.insertRow(row)
+    self.table.setItem(row, 0, QTableWidgetItem(str(key_id)))
+    self.table.setItem(row, 1, QTableWidgetItem(btc_addr))
+    self.table.setItem(row, 2, QTableWidgetItem('Please wait!'))
+    self.rows[btc_addr] = row
+
+  def addresses_loaded(self, result):
+    """ Starts requesting the balances once all addresses are known.
+    """
+    refresh_id, btc_addrs = result
+    if(refresh_id != self.refresh_id):
+      return
+    self._batches = [btc_addrs[batch:batch + self.batch_size] for batch in range(0, len(btc_addrs), self.batch_size)]
+    for request in range(self.max_requests):
+      self.request_balances()
+
+  def request_balances(self):
+    """ Requests the balances of the next batch of addresses, unless 
+    `max_requests` requests are already running.
+    """
+    if(self._batches and (self._requests < self.max_requests)):
+      batch = self._batches.pop(0)
+      self._requests = self._requests + 1
+      workers.submit(
+          blockchain_info.fetch_balances, batch,
+          on_done = partial(self.balances_loaded, self.refresh_id),
+          on_error = partial(self.balances_failed, self.refresh_id, batch)
+        )
+
+  def balances_loaded(self, refresh_id, balances):
+    """ Shows the balances of a batch as soon as they arrive.
+    """
+    if(refresh_id != self.refresh_id):
+      return
+    self._requests = self._requests - 1
+    for btc_addr, balance in balances.items():
+      self.balances[btc_addr] = balance
+      self.table.item(self.rows[btc_addr], 2).setText(str(balance))
+    self.show_total()
+    self.request_balances()
+    if(0 == self._requests):
+      message('Portfolio loaded!')
+
+  def balances_failed(self, refresh_id, batch, details):
+    """ Marks the balances of a batch as unknown.
+    """
+    if(refresh_id != self.refresh_id):
+      return
+    self._requests = self._requests - 1
+    for btc_addr in batch:
+      self.table.item(self.rows[btc_addr], 2).setText('Unknown')
+    message('Please check the internet connection! ' + str(details), 'warn')
+    self.request_balances()
+
+  def show_total(self):
+    """ Shows the total balance of all keypairs loaded so far.
+    """
+    total = sum(self.balances.values())
+    total_text = (
+        'Total balance of '
+      + str(len(self.balances))
+      + ' / '
+      + str(len(self.rows))
+      + ' keypairs: '
+      + '%0.3f' % (total / (10 ** 5))
+      + ' Milli-Bitcoin ('
+      + str(total)
+      + ' Satoshi'
+      )
+    if(ticker.rate):
+      total_text = total_text + ', ' + '%0.3f' % (total / (10 ** 8) * ticker.rate) + ' Euro'
+    self.total_label.setText(total_text + ')')
+
 def close_event():
   """ Cleans up and exits program.
+
+  The workers finish their work before the logs and signing 
+  sessions they write to are closed.
   """
-  ui.clear_card_frame() # Delete qrcode image
-  if(ui.card.logger):
-    ui.card.logger.close()
-  observer.stop(cardmonitor, cardobserver)
-  if(reader.card_connected == True):
-    activate_card() # Reset PIN
+  ui.keypairs.scanner.stop()
+  ui.clear_card_frame()
+  if(cardmonitor):
+    observer.stop(cardmonitor, cardobserver)
+  ticker.stop()
+  stop_metrics()
+  if(ui.blockchain_poll):
+    ui.blockchain_poll.stop()
+  scheduler.stop()
+  workers.shutdown(wait = True)
+  readers.shutdown(wait = True)
+  for pending in ui.card.transactions:
+    pending.logger.close()
+  http_session.close()
+  tx_logs.close()
+  signing_sessions.close()
+  for session in readers.get_connected():
+    activate_card(session) # Reset PIN
   message('Exit!')
   exit()
 
 ## Bitcoin related classes and functions:
+def compress_public_key(public_key):
+  """ Transforms an uncompressed `public_key` into its compressed form.
+
+  The compressed form only holds the x coordinate and whether the y 
+  coordinate is even or odd. SegWit only allows compressed public keys.
+  """
+  if(33 == len(public_key)):
+    return public_key
+  x_coordinate = public_key[1:33]
+  y_coordinate = public_key[33:65]
+  if(y_coordinate[-1] % 2):
+    return bytes([0x03]) + x_coordinate
+  return bytes([0x02]) + x_coordinate
+
 def pub_key_to_BTC_Addr(public_key):
-  """ Transforms a raw `public_key` into a base58 encoded 
-  Bitcoin adress.
+  """ Transforms a raw `public_key` into a Bitcoin adress.
+
+  Depending on `address_format` this is a base58 encoded 
+  legacy address or a bech32 encoded SegWit address.
   """
+  if('bech32' == address_format):
+    return pub_key_to_bech32_Addr(public_key)
+
+  import base58
+
   # Public Key
   message('public_key:', 'dev')
-  message(public_key.hex(), 'dev')
+  message('%s', 'dev', lazy_hex(public_key))
 
   # Ripemd160(Sha256(Public Key))
   message('Ripemd160(Sha256(public_key)):', 'dev')
@@ -793,7 +2796,7 @@ def pub_key_to_BTC_Addr(public_key):
   hash = hashlib.new('ripemd160')
   hash.update(hash_result)
   hash_result = hash.digest()
-  message(hash_result.hex(), 'dev')
+  message('%s', 'dev', lazy_hex(hash_result))
 
   # Add Bitcoin Network ID
   # --> Main Network: 0x00 <--
@@ -801,7 +2804,7 @@ def pub_key_to_BTC_Addr(public_key):
   message('Add Main Bitcoin Network ID:', 'dev')
   network_byte = bytes([0x00])
   result = network_byte + hash_result
-  message(result.hex(), 'dev')
+  message('%s', 'dev', lazy_hex(result))
 
   # Checksum (2 x SHA256)
   message('Get Checksum:', 'dev')
@@ -814,128 +2817,429 @@ def pub_key_to_BTC_Addr(public_key):
   hash = hashlib.sha256()
   hash.update(hash_result)
   checksum_result = hash.digest()
-  message(checksum_result.hex(), 'dev')
+  message('%s', 'dev', lazy_hex(checksum_result))
   message('Get first 4 Checksum bytes:', 'dev')
-  message(checksum_result[:4].hex(), 'dev')
+  message('%s', 'dev', lazy_hex(checksum_result[:4]))
 
   # Add Checksum
   message('Add Checksum:', 'dev')
   result = result + checksum_result[:4]
-  message(result.hex(), 'dev')
+  message('%s', 'dev', lazy_hex(result))
+
+  # Base58
+  message('Bitcoin Address:', 'dev')
+  btc_addr = base58.b58encode(result).decode('utf-8')
+  message('%s', 'dev', btc_addr)
+  return btc_addr
+
+def pub_key_to_bech32_Addr(public_key):
+  """ Transforms a raw `public_key` into a bech32 encoded 
+  native SegWit (P2WPKH) Bitcoin adress.
+  """
+  import bech32
+
+  # Compressed Public Key
+  message('Compressed public_key:', 'dev')
+  public_key = compress_public_key(public_key)
+  message('%s', 'dev', lazy_hex(public_key))
+
+  # Ripemd160(Sha256(Public Key))
+  message('Ripemd160(Sha256(public_key)):', 'dev')
+  hash = hashlib.new('ripemd160')
+  hash.update(hashlib.sha256(public_key).digest())
+  hash_result = hash.digest()
+  message('%s', 'dev', lazy_hex(hash_result))
 
-  # Base58
+  # Bech32 with witness version 0
+  # --> Main Network: bc <--
+  #     Test Network: tb
   message('Bitcoin Address:', 'dev')
-  btc_addr = base58.b58encode(result).decode('utf-8')
-  message(btc_addr, 'dev')
+  btc_addr = bech32.encode('bc', 0x00, hash_result)
+  message('%s', 'dev', btc_addr)
   return btc_addr
 
+def check_btc_addr(btc_addr):
+  """ Checks that `btc_addr` is a legacy or native SegWit Bitcoin 
+  address, including its checksum, and raises a `Warning` if not.
+  """
+  if(btc_addr.startswith('1')):
+    import base58
+    try:
+      decoded = base58.b58decode_check(btc_addr)
+    except ValueError:
+      decoded = None
+    if((None == decoded) or (21 != len(decoded))):
+      raise Warning('Invalid base58 address: ' + btc_addr)
+  elif(btc_addr.startswith('bc1')):
+    import bech32
+    witness_version, witness_program = bech32.decode('bc', btc_addr)
+    if(None == witness_program):
+      raise Warning('Invalid bech32 address: ' + btc_addr)
+  else:
+    raise Warning('Only addresses starting with "1" or "bc1" are supported: ' + btc_addr)
+
+def double_sha256(data):
+  """ Hashes `data` twice with SHA256, like Bitcoin does for 
+  transactions and checksums.
+  """
+  return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
 class transaction:
   """ Manages the Bitcoin transaction structure and 
   generates a broadcastable transaction.
   """
-  def __init__(self, btc_addr, logger):
+  def __init__(self, btc_addr, logger, payments, fee, key_id, session = None):
     self.btc_addr = btc_addr
     self.blockchain = blockchain_info(self.btc_addr)
     self.logger = logger
-    self.tx_helper = transaction_helper(self.blockchain, self.logger)
+    self.tx_helper = transaction_helper(self.blockchain, self.logger, payments, fee, btc_addr)
+    self.key_id = key_id
+    self.session = session # Reader of the card, see generate_signature
+    self.txid = None
+    self.signing = None # See open_signing_session
+    self.spent_outputs = []
+    self.change_outputs = []
 
   def make(self, public_key):
     """ Builds unsigned and signed transactions.
 
     Keep in mind that the number of signatures generated depends on 
     how many inputs you have, not how many transaction you do!
+    Runs on a worker thread, so it must not touch the UI directly.
     """
     Version = self.tx_helper.get_version()
+    # Every spent output needs its own signature, so only spend 
+    # as many as the payments need. Change below the dust value goes 
+    # to the fee, see `make_tx_outputs`.
+    self.blockchain.select_unspent_outputs(
+        self.tx_helper.get_payment_total() + self.tx_helper.fee,
+        self.tx_helper.min_tx_amount
+      )
     Number_of_TxIn = self.blockchain.get_total_input_number()
     if(Number_of_TxIn >= 0xFD):
       raise Warning('Too many Inputs - transaction fees might be too high!')
 
-    SigScript = [None] * Number_of_TxIn
-    old_PkScript = self.tx_helper.get_pub_key_script(self.btc_addr)
-    
     Standard_TxOut = self.tx_helper.make_tx_outputs()
     Number_of_TxOut = self.tx_helper.get_total_output_number()
 
-    self.logger.write_to_file('Own address: ' + ui.qrcode_description.text())
-    self.logger.write_to_file('Target address: ' + ui.target_address.text())
+    self.logger.write_to_file('Own address: ' + self.btc_addr)
+    for target_addr, target_amount in self.tx_helper.get_payments():
+      self.logger.write_to_file('Target address: ' + target_addr + ' (' + str(target_amount) + ' Satoshi)')
     self.logger.write_to_file()
-    self.logger.write_to_file('Amount: ' + ui.confirm.payment_info[0])
-    self.logger.write_to_file('Fee: ' + ui.confirm.payment_info[1])
-    self.logger.write_to_file('Change: ' + ui.confirm.payment_info[2])
+    self.logger.write_to_file('Amount: ' + str(self.tx_helper.payment_info[0]))
+    self.logger.write_to_file('Fee: ' + str(self.tx_helper.payment_info[1]))
+    self.logger.write_to_file('Change: ' + str(self.tx_helper.payment_info[2]))
     self.logger.write_to_file('\n')
 
     LockTime = self.tx_helper.get_lock_time()
+    self.open_signing_session(Version, Number_of_TxIn, Number_of_TxOut, Standard_TxOut, LockTime)
+
+    if(self.btc_addr.startswith('bc1')):
+      signed_tx = self.make_segwit(public_key, Version, Number_of_TxIn, Number_of_TxOut, Standard_TxOut, LockTime)
+    else:
+      signed_tx = self.make_legacy(public_key, Version, Number_of_TxIn, Number_of_TxOut, Standard_TxOut, LockTime)
+
+    # Remember what this transaction changes, so that the local 
+    # unspent outputs can be updated once it is broadcasted.
+    self.spent_outputs = self.blockchain.get_unspent_outputs()
+    self.change_outputs = []
+    if(self.tx_helper.change_present):
+      self.change_outputs.append({
+        'tx_hash': self.txid.hex(),
+        'tx_output_n': len(self.tx_helper.get_payments()),
+        'value': self.tx_helper.payment_info[2]
+      })
+
+    self.logger.write_to_file('  Transaction ID: ' + self.txid[::-1].hex())
+    self.logger.write_to_file('  Signed Transaction: ' + signed_tx.hex())
+    
+    self.logger.close(self.txid[::-1].hex())
+
+    return signed_tx
+
+  def open_signing_session(self, Version, Number_of_TxIn, Number_of_TxOut, Standard_TxOut, LockTime):
+    """ Opens the signing session of this transaction, which holds the 
+    signatures of an earlier attempt to sign it.
+
+    The session is identified by the unsigned transaction: the same 
+    outputs spent to the same payments with the same fee.
+    """
+    Sequence = self.tx_helper.get_sequence()
+    unsigned_tx = b''.join([
+        Version,
+        bytes([Number_of_TxIn]),
+        *[self.tx_helper.get_outpoint(TxIn) + Sequence for TxIn in range(Number_of_TxIn)],
+        Number_of_TxOut,
+        Standard_TxOut,
+        LockTime
+      ])
+    self.signing = signing_sessions.open(self.btc_addr, unsigned_tx)
+
+  def make_legacy(self, public_key, Version, Number_of_TxIn, Number_of_TxOut, Standard_TxOut, LockTime):
+    """ Signs every input with a legacy signature inside its 
+    SigScript and builds the signed transaction.
+    """
+    old_PkScript = self.tx_helper.get_pub_key_script(self.btc_addr)
     HashTypeCode = self.tx_helper.get_hash_type_code('SIGHASH_ALL')
 
+    # Every input signs the same transaction, except that its own 
+    # SigScript is replaced by the previous PkScript. The unsigned 
+    # transaction is therefore only build and logged once.
+    self.logger.write_to_file('  Unsigned transaction template:')
+    self.logger.write_to_file('    Version: ' + Version.hex())
+    self.logger.write_to_file('    Number of transaction inputs: ' + bytes([Number_of_TxIn]).hex())
+    SubScript = [None] * Number_of_TxIn
+    Unsigned_TxIn = [None] * Number_of_TxIn
+    for TxIn in range(Number_of_TxIn):
+      Unsigned_TxIn[TxIn] = self.tx_helper.make_tx_input('unsigned', TxIn, SubScript)
+    self.logger.write_to_file('    Number of transaction outputs: ' + Number_of_TxOut.hex())
+    self.logger.write_to_file('    Standard TxOut: ' + Standard_TxOut.hex())
+    self.logger.write_to_file('    LockTime: ' + LockTime.hex())
+    self.logger.write_to_file('    HashTypeCode: ' + HashTypeCode.hex())
+    self.logger.write_to_file()
+
+    Signing_TxIn = [None] * Number_of_TxIn
     for script in range(Number_of_TxIn):
-      self.logger.write_to_file('  Unsigned transaction for input ' + str(script + 1) + ':')
-      self.logger.write_to_file('    Version: ' + Version.hex())
-      self.logger.write_to_file('    Number of transaction inputs: ' + bytes([Number_of_TxIn]).hex())
-      
-      All_Standard_TxIn = bytes()
+      self.logger.write_to_file('  Unsigned transaction for input ' + str(script + 1) + ' (template with replaced SigScript):')
+      SubScript[script] = old_PkScript
+      Signing_TxIn[script] = self.tx_helper.make_tx_input('unsigned', script, SubScript)
+      SubScript[script] = None
+    self.logger.write_to_file()
+
+    hashed_txs_to_sign = self.tx_helper.get_legacy_sighashes(
+        Version + bytes([Number_of_TxIn]),
+        Unsigned_TxIn,
+        Signing_TxIn,
+        Number_of_TxOut + Standard_TxOut + LockTime + HashTypeCode
+      )
+
+    SigScript = self.sign_inputs(hashed_txs_to_sign, partial(self.make_sig_script, public_key))
 
-      Standard_TxIn = [None] * Number_of_TxIn
-      Standard_TxIn[script] = old_PkScript
+    self.logger.write_to_file()
+    self.logger.write_to_file('  Public key: ' + public_key.hex())
+
+    All_Standard_TxIn = [None] * Number_of_TxIn
+    for TxIn in range(Number_of_TxIn):
+      All_Standard_TxIn[TxIn] = self.tx_helper.make_tx_input('signed', TxIn, SigScript)
+
+    signed_tx = b''.join([
+        Version,
+        bytes([Number_of_TxIn]),
+        *All_Standard_TxIn,
+        Number_of_TxOut,
+        Standard_TxOut,
+        LockTime
+      ])
+    self.txid = double_sha256(signed_tx)
+    return signed_tx
+
+  def make_segwit(self, public_key, Version, Number_of_TxIn, Number_of_TxOut, Standard_TxOut, LockTime):
+    """ Signs every input with a native SegWit (P2WPKH) signature 
+    inside its witness and builds the signed transaction.
 
-      for TxIn in range(Number_of_TxIn):
-        All_Standard_TxIn = All_Standard_TxIn + self.tx_helper.make_tx_input('unsigned', TxIn, Standard_TxIn)
+    The transaction to sign is build as described in BIP143. The 
+    hashes of all outpoints, sequences and outputs are the same for 
+    every input, so they are only calculated once.
+    """
+    public_key = compress_public_key(public_key)
+    HashTypeCode = self.tx_helper.get_hash_type_code('SIGHASH_ALL')
+    Marker = bytes([0x00])
+    Flag = bytes([0x01])
+
+    # The scriptCode of a P2WPKH input is the standard legacy PkScript 
+    # of the public key hash inside the witness program.
+    public_key_hash = self.tx_helper.get_pub_key_script(self.btc_addr)[2:]
+    scriptCode = (
+        bytes([0x19])
+      + self.tx_helper.get_op_code('OP_DUP')
+      + self.tx_helper.get_op_code('OP_HASH160')
+      + bytes([0x14])
+      + public_key_hash
+      + self.tx_helper.get_op_code('OP_EQUALVERIFY')
+      + self.tx_helper.get_op_code('OP_CHECKSIG')
+      )
 
-      self.logger.write_to_file('    Number of transaction outputs: ' + Number_of_TxOut.hex())
-      self.logger.write_to_file('    Standard TxOut: ' + Standard_TxOut.hex())
+    Outpoint = [None] * Number_of_TxIn
+    for TxIn in range(Number_of_TxIn):
+      Outpoint[TxIn] = self.tx_helper.get_outpoint(TxIn)
+    Sequence = self.tx_helper.get_sequence()
+
+    hashPrevouts = double_sha256(b''.join(Outpoint))
+    hashSequence = double_sha256(Sequence * Number_of_TxIn)
+    hashOutputs = double_sha256(Standard_TxOut)
+
+    self.logger.write_to_file('  BIP143 hashes shared by all inputs:')
+    self.logger.write_to_file('    hashPrevouts: ' + hashPrevouts.hex())
+    self.logger.write_to_file('    hashSequence: ' + hashSequence.hex())
+    self.logger.write_to_file('    hashOutputs: ' + hashOutputs.hex())
+    self.logger.write_to_file('    scriptCode: ' + scriptCode.hex())
+    self.logger.write_to_file()
 
-      tx_to_sign = (
+    # All hashes are known before the card signs the first one
+    txs_to_sign = [None] * Number_of_TxIn
+    hashed_txs_to_sign = [None] * Number_of_TxIn
+    for script in range(Number_of_TxIn):
+      Amount = struct.pack('<Q', self.blockchain.get_value(script))
+      txs_to_sign[script] = (
           Version
-        + bytes([Number_of_TxIn])
-        + All_Standard_TxIn
-        + Number_of_TxOut
-        + Standard_TxOut
+        + hashPrevouts
+        + hashSequence
+        + Outpoint[script]
+        + scriptCode
+        + Amount
+        + Sequence
+        + hashOutputs
         + LockTime
         + HashTypeCode
-      )
+        )
+      hashed_txs_to_sign[script] = double_sha256(txs_to_sign[script])
 
-      key_id = ui.key_id_info.text()
-      hashed_tx_to_sign = hashlib.sha256(hashlib.sha256(tx_to_sign).digest()).digest()
-      global_counter, counter, signature = generate_signature(key_id, hashed_tx_to_sign)
+    Witness = self.sign_inputs(hashed_txs_to_sign, partial(self.make_witness, public_key, txs_to_sign))
 
-      ui.card.set_key_info(key_id, global_counter, counter)
+    self.logger.write_to_file('  Public key: ' + public_key.hex())
 
-      constant = self.tx_helper.get_op_code('N/A', 0x01)
-      signature_len = bytes([len(signature) + len(constant)])
-      public_key_len = bytes([len(public_key)])
+    SigScript = [None] * Number_of_TxIn
+    All_Standard_TxIn = [None] * Number_of_TxIn
+    for TxIn in range(Number_of_TxIn):
+      All_Standard_TxIn[TxIn] = self.tx_helper.make_tx_input('unsigned', TxIn, SigScript)
+    for TxIn in range(Number_of_TxIn):
+      self.logger.write_to_file('    Witness ' + str(TxIn + 1) + ': ' + Witness[TxIn].hex())
+
+    signed_tx = b''.join([
+        Version,
+        Marker,
+        Flag,
+        bytes([Number_of_TxIn]),
+        *All_Standard_TxIn,
+        Number_of_TxOut,
+        Standard_TxOut,
+        *Witness,
+        LockTime
+      ])
+    # The transaction ID does not include the witnesses
+    self.txid = double_sha256(b''.join([
+        Version,
+        bytes([Number_of_TxIn]),
+        *All_Standard_TxIn,
+        Number_of_TxOut,
+        Standard_TxOut,
+        LockTime
+      ]))
+    return signed_tx
 
-      self.logger.write_to_file('  Transaction to sign prehash: ' + tx_to_sign.hex())
-      self.logger.write_to_file('  Transaction to sign hash: ' + hashed_tx_to_sign.hex())
-      self.logger.write_to_file('  Signature for standard transaction input ' + str(script + 1) + ': ' + signature.hex())
-      self.logger.write_to_file()
-      
-      SigScript[script] =  signature_len + signature + constant + public_key_len + public_key
+  def make_sig_script(self, public_key, script, hashed_tx_to_sign, signature):
+    """ Logs the signature of input `script` and returns its SigScript.
+    """
+    constant = self.tx_helper.get_op_code('N/A', 0x01)
+    signature_len = bytes([len(signature) + len(constant)])
 
+    self.logger.write_to_file('  Transaction to sign hash for input ' + str(script + 1) + ': ' + hashed_tx_to_sign.hex())
+    self.logger.write_to_file('  Signature for standard transaction input ' + str(script + 1) + ': ' + signature.hex())
     self.logger.write_to_file()
-    self.logger.write_to_file('  Public key: ' + public_key.hex())
 
-    All_Standard_TxIn = bytes()
-    for TxIn in range(Number_of_TxIn):
-      All_Standard_TxIn = All_Standard_TxIn + self.tx_helper.make_tx_input('signed', TxIn, SigScript)
+    return signature_len + signature + constant + bytes([len(public_key)]) + public_key
 
-    signed_tx = (
-          Version
-        + bytes([Number_of_TxIn])
-        + All_Standard_TxIn
-        + Number_of_TxOut
-        + Standard_TxOut
-        + LockTime
+  def make_witness(self, public_key, txs_to_sign, script, hashed_tx_to_sign, signature):
+    """ Logs the signature of input `script` and returns its witness.
+    """
+    constant = self.tx_helper.get_op_code('N/A', 0x01)
+
+    self.logger.write_to_file('  Transaction to sign prehash for input ' + str(script + 1) + ': ' + txs_to_sign[script].hex())
+    self.logger.write_to_file('  Transaction to sign hash for input ' + str(script + 1) + ': ' + hashed_tx_to_sign.hex())
+    self.logger.write_to_file('  Signature for SegWit transaction input ' + str(script + 1) + ': ' + signature.hex())
+    self.logger.write_to_file()
+
+    # Number of stack items, signature with hash type and public key
+    return (
+        bytes([0x02])
+      + bytes([len(signature) + len(constant)])
+      + signature
+      + constant
+      + bytes([len(public_key)])
+      + public_key
       )
 
-    self.logger.write_to_file('  Signed Transaction: ' + signed_tx.hex())
-    
-    self.logger.close()
+  def sign_inputs(self, hashed_txs_to_sign, assemble):
+    """ Lets the card sign the hashes of all inputs and returns what 
+    `assemble` makes of each signature (the SigScript or witness), 
+    in the order of the inputs.
 
-    return signed_tx
+    The card is by far the slowest part of signing, so it gets the 
+    hashes back-to-back: while it signs the next hash, the last 
+    signature is saved, assembled and logged on a thread of its own.
+    Inputs which were signed by an earlier attempt are not signed again.
+    """
+    Number_of_TxIn = len(hashed_txs_to_sign)
+    saved_signatures = [None] * Number_of_TxIn
+    for script in range(Number_of_TxIn):
+      saved_signatures[script] = self.signing.get_signature(script, hashed_txs_to_sign[script])
+    resumed = Number_of_TxIn - saved_signatures.count(None)
+    if(resumed):
+      message('Resuming signing with %d of %d inputs signed!', None, resumed, Number_of_TxIn)
+      self.logger.write_to_file('  Signatures of ' + str(resumed) + ' inputs were made by an earlier attempt.')
+      self.logger.write_to_file()
+
+    results = [None] * Number_of_TxIn
+    errors = []
+    signatures = Queue()
+    assembler = threading.Thread(target = self.assemble_inputs, args = [signatures, assemble, results, errors], name = 'assembler')
+    assembler.start()
+    try:
+      for script in range(Number_of_TxIn):
+        if(errors):
+          break # The transaction can not be finished anyway
+        if(None != saved_signatures[script]):
+          signatures.put((script, hashed_txs_to_sign[script], None, None, saved_signatures[script]))
+        else:
+          global_counter, counter, signature = generate_signature(self.key_id, hashed_txs_to_sign[script], self.session)
+          signatures.put((script, hashed_txs_to_sign[script], global_counter, counter, signature))
+    except Exception as details:
+      errors.append(details)
+    signatures.put(None) # No more signatures
+    assembler.join()
+
+    if(errors):
+      signed = len(self.signing.signatures)
+      if(0 < signed < Number_of_TxIn):
+        raise Warning(
+            'Signing stopped after ' + str(signed) + ' of ' + str(Number_of_TxIn) + ' inputs (' 
+          + str(errors[0]) + ')! Generate the transaction again to sign the rest.'
+          )
+      raise errors[0]
+    self.signing.finish()
+    return results
+
+  def assemble_inputs(self, signatures, assemble, results, errors):
+    """ Saves and assembles the signatures from `sign_inputs` as they 
+    come in.
+    """
+    while(True):
+      item = signatures.get()
+      if(None == item):
+        return
+      script, hashed_tx_to_sign, global_counter, counter, signature = item
+      if(None != counter): # Made by the card just now
+        try:
+          self.signing.save(script, hashed_tx_to_sign, signature)
+        except Exception as details:
+          message('Signature not saved: %s', 'dev', details)
+        gui.call(ui.card.show_counters, self.session, self.key_id, global_counter, counter)
+      if(not errors):
+        try:
+          results[script] = assemble(script, hashed_tx_to_sign, signature)
+        except Exception as details:
+          errors.append(details)
 
 class transaction_helper:
-  def __init__(self, blockchain, logger):
+  min_tx_amount = 546 # minimum amount of satoshi required for tx
+
+  def __init__(self, blockchain, logger, payments = None, fee = 0, btc_addr = None):
     self.logger = logger
     self.blockchain = blockchain
+    self.payments = payments or []
+    self.fee = fee
+    self.btc_addr = btc_addr
+    self.payment_info = None
     self.change_present = None
 
   def get_version(self):
@@ -949,6 +3253,50 @@ class transaction_helper:
     version = 0x00000001
     return struct.pack('<L', version)
 
+  def get_compact_size(self, number):
+    """ Encodes `number` as a variable length integer, which is how 
+    Bitcoin stores counts and lengths.
+
+    Numbers below 0xFD take 1 byte, bigger numbers get a prefix byte 
+    followed by 2, 4 or 8 bytes.
+    """
+    if(0 <= number < 0xFD):
+      return struct.pack('<B', number)
+    elif(number <= 0xFFFF):
+      return bytes([0xFD]) + struct.pack('<H', number)
+    elif(number <= 0xFFFFFFFF):
+      return bytes([0xFE]) + struct.pack('<L', number)
+    elif(number <= 0xFFFFFFFFFFFFFFFF):
+      return bytes([0xFF]) + struct.pack('<Q', number)
+    else:
+      raise Warning('Number too big for a transaction!')
+
+  def get_payments(self):
+    """ Returns all payments of the transaction as a list of 
+    `(target address, amount)` tuples.
+    """
+    return self.payments
+
+  def get_payment_total(self):
+    """ Returns the amount of all payments together.
+    """
+    return sum(amount for target_addr, amount in self.get_payments())
+
+  def get_outpoint(self, cycle):
+    """ Returns the outpoint of an unspent output, which is the 
+    transaction hash followed by the output index.
+    """
+    TxOutHash = bytes.fromhex(self.blockchain.get_tx_hash(cycle))
+    TxOutIndex = struct.pack('<L', self.blockchain.get_tx_o_n(cycle))
+    return TxOutHash + TxOutIndex
+
+  def get_sequence(self):
+    """ The `sequence` of every input.
+
+    The sequence changes depending on the lock time.
+    """
+    return struct.pack('<L', 0xFFFFFFFF)
+
   def make_tx_input(self, transaction_type, cycle, script):
     """ Builds a single standard transaction input based on `type`.
     
@@ -958,45 +3306,23 @@ class transaction_helper:
     TxOutHash = bytes.fromhex(self.blockchain.get_tx_hash(cycle))
     TxOutIndex = struct.pack('<L', self.blockchain.get_tx_o_n(cycle))
 
-    # The sequence changes depending on the lock time
-    Sequence = struct.pack('<L', 0xFFFFFFFF)
+    Sequence = self.get_sequence()
 
     if('unsigned' == transaction_type):
       if(None == script[cycle]):
         ScriptLen = bytes([0x00])
         SigScript = bytes()
       elif(bytes == type(script[cycle])):
-        ScriptLen = len(script[cycle])
-        if(0x00 < ScriptLen < 0xFD):
-          ScriptLen = struct.pack('<B', ScriptLen)
-        elif(0xFD <= ScriptLen <= 0xFFFF):
-          ScriptLen = struct.pack('<H', ScriptLen)
+        if(len(script[cycle]) >= 0xFD):
           message('Script unusually long!', 'warn')
-        elif(0xFFFF < ScriptLen <= 0xFFFFFFFF):
-          ScriptLen = struct.pack('<L', ScriptLen)
-          message('Script unusually long!', 'warn')
-        elif(0xFFFFFFFF < ScriptLen < 0xFFFFFFFFFFFFFFFF):
-          ScriptLen = struct.pack('<Q', ScriptLen)
-          message('Script unusually long!', 'warn')
-        else:
-          raise Warning('SigScript too long!') 
+        ScriptLen = self.get_compact_size(len(script[cycle]))
         SigScript = script[cycle]
       else:
         raise RuntimeError('Unsigned transaction - SigScript invalid!')
     elif('signed' == transaction_type):
-      ScriptLen = len(script[cycle])
-      if(0x00 < ScriptLen < 0xFD):
-        ScriptLen = struct.pack('<B', ScriptLen)
-      elif(0xFD <= ScriptLen <= 0xFFFF):
-        ScriptLen = struct.pack('<H', ScriptLen)
-      elif(0xFFFF < ScriptLen <= 0xFFFFFFFF):
-        ScriptLen = struct.pack('<L', ScriptLen)
-        message('Script unusually long!', 'warn')
-      elif(0xFFFFFFFF < ScriptLen < 0xFFFFFFFFFFFFFFFF):
-        ScriptLen = struct.pack('<Q', ScriptLen)
+      if(len(script[cycle]) > 0xFFFF):
         message('Script unusually long!', 'warn')
-      else:
-        raise Warning('SigScript too long!')
+      ScriptLen = self.get_compact_size(len(script[cycle]))
       SigScript = script[cycle]
     else:
       raise SpellingMistake()
@@ -1011,12 +3337,44 @@ class transaction_helper:
     Standard_TxIn = TxOutHash + TxOutIndex + ScriptLen + SigScript + Sequence
     return Standard_TxIn
 
+  def get_legacy_sighashes(self, prefix, unsigned_inputs, signing_inputs, suffix):
+    """ Hashes the transaction that has to be signed for every input 
+    of a legacy (non SegWit) transaction.
+
+    The transaction for input `n` is `prefix`, all `unsigned_inputs` 
+    with input `n` replaced by `signing_inputs[n]` and `suffix`. 
+    Instead of building and hashing each of these transactions from 
+    scratch, the transaction is serialized once and the SHA256 state 
+    of everything in front of input `n` is reused, so that only 
+    input `n` and the bytes behind it have to be hashed again.
+    """
+    template = bytearray(prefix)
+    offsets = [None] * (len(unsigned_inputs) + 1)
+    for TxIn in range(len(unsigned_inputs)):
+      offsets[TxIn] = len(template)
+      template += unsigned_inputs[TxIn]
+    offsets[-1] = len(template)
+    template += suffix
+    template_view = memoryview(template)
+
+    sighashes = [None] * len(unsigned_inputs)
+    prefix_hash = hashlib.sha256(template_view[:offsets[0]])
+    for TxIn in range(len(unsigned_inputs)):
+      hash = prefix_hash.copy()
+      hash.update(signing_inputs[TxIn])
+      hash.update(template_view[offsets[TxIn + 1]:])
+      sighashes[TxIn] = hashlib.sha256(hash.digest()).digest()
+      prefix_hash.update(template_view[offsets[TxIn]:offsets[TxIn + 1]])
+    template_view.release()
+    return sighashes
+
   def get_pub_key_script(self, btc_addr):
     """ Decodes and strips the Bitcoin address to the format that 
     is achived when you hash the public key - `RIPEMD160(SHA256(public_key))`.
     """
     if(btc_addr.startswith("1")):
-      message('"base58" Address detected: ' + btc_addr, 'dev')
+      import base58
+      message('"base58" Address detected: %s', 'dev', btc_addr)
       btc_addr_striped = base58.b58decode(btc_addr)[1:21]
       pub_key_script = (
           self.get_op_code('OP_DUP')
@@ -1026,29 +3384,37 @@ class transaction_helper:
         + self.get_op_code('OP_EQUALVERIFY')
         + self.get_op_code('OP_CHECKSIG')
         )
-    if(btc_addr.startswith("bc1")):
-      message('"bech32" Address detected: ' + btc_addr, 'dev')
-      public_key_hash = bech32.decode("bc", btc_addr)
+    elif(btc_addr.startswith("bc1")):
+      import bech32
+      message('"bech32" Address detected: %s', 'dev', btc_addr)
+      witness_version, witness_program = bech32.decode("bc", btc_addr)
+      if(None == witness_program):
+        raise Warning('Invalid bech32 address: ' + btc_addr)
+      if(0 == witness_version):
+        witness_version_code = 0x00
+      else:
+        witness_version_code = 0x50 + witness_version # OP_1 to OP_16
       pub_key_script = (
-          bytes([0x00])
-        + bytes([0x14])
-        + bytes(public_key_hash[1])
+          bytes([witness_version_code])
+        + bytes([len(witness_program)])
+        + bytes(witness_program)
         )
-    print(pub_key_script.hex())
+    else:
+      raise Warning('Only addresses starting with "1" or "bc1" are supported: ' + btc_addr)
+    message('%s', 'dev', lazy_hex(pub_key_script))
     return pub_key_script
 
   def get_total_output_number(self):
     """ Describes how many outputs exist.
 
-    If there is no change left after the transaction is done, then there 
-    is 1 output (to the target address), else there are 2 outputs. One to 
-    the target and one to the sender her-/himself.
+    There is 1 output for every payment. If there is change left after 
+    the transaction is done, then there is 1 more output to the sender 
+    her-/himself.
     """
-    if(self.change_present == False):
-      output_number = 0x01
-    else:
-      output_number = 0x02
-    return bytes([output_number])
+    output_number = len(self.get_payments())
+    if(self.change_present != False):
+      output_number = output_number + 1
+    return self.get_compact_size(output_number)
 
   def make_tx_outputs(self):
     """ Calculates the returned change, if any exists and builds all 
@@ -1059,42 +3425,48 @@ class transaction_helper:
     This is why its crucial to calculate the change. 
     Another very important thing about this part of the transaction is 
     the fact that values under the so called `dust` value should not be 
-    broadcasted.
+    broadcasted, so such change is added to the fee instead.
     """
-    amount = int(ui.amount.text())
-    fee = int(ui.fee.text())
+    payments = self.get_payments()
+    amount = self.get_payment_total()
+    fee = self.fee
 
     total_bal = 0
-    min_tx_amount = 546 # minimum amount of satoshi required for tx
+    min_tx_amount = self.min_tx_amount
 
     total_bal = self.blockchain.get_bal_of_uo()
     change = total_bal - (amount + fee)
 
-    # message('Total Balance: ' + str(total_bal), 'dev')
-    # message('Target amount: ' + str(amount), 'dev')
-    # message('Fee: ' + str(fee), 'dev')
-    # message('Change: ' + str(change), 'dev')
+    # message('Total Balance: %s', 'dev', total_bal)
+    # message('Target amount: %s', 'dev', amount)
+    # message('Fee: %s', 'dev', fee)
+    # message('Change: %s', 'dev', change)
+
+    if(0 < change < min_tx_amount):
+      # Coin selection leaves such change on purpose instead of 
+      # spending another output, so it is paid as fee right away.
+      message('Change falls under Dust value, %d Satoshi added to the fee!', 'dev', change)
+      fee = fee + change
+      change = 0
+      self.fee = fee
 
-    ui.confirm.set_payment_info(amount, fee, change)
+    self.payment_info = (amount, fee, change)
 
     if(total_bal < amount + fee):
       raise Warning('Balance too low for this transaction!')
-    elif(0 < change < min_tx_amount):
-      adjust_for_dust = change
-      ui.fee.setText(str(fee + adjust_for_dust))
-      raise Warning('Change falls under Dust value! Fees have been adjusted!')
     else:
-      all_outputs = bytes()
-
-      value = struct.pack('<Q', int(amount))
-      recipient_addr = self.get_pub_key_script(ui.target_address.text())
-      script_len = len(recipient_addr).to_bytes(1, "big")
-
-      output_target = (
-          value
-        + script_len
-        + recipient_addr
-        )
+      output_target = [None] * len(payments)
+      for payment in range(len(payments)):
+        target_addr, target_amount = payments[payment]
+        value = struct.pack('<Q', int(target_amount))
+        recipient_addr = self.get_pub_key_script(target_addr)
+        script_len = self.get_compact_size(len(recipient_addr))
+
+        output_target[payment] = (
+            value
+          + script_len
+          + recipient_addr
+          )
 
       if(0 == change):
         self.change_present = False
@@ -1103,8 +3475,8 @@ class transaction_helper:
         self.change_present = True
 
         value = struct.pack('<Q', int(change))
-        script_len = bytes([0x19]) # Standard PkScript len = 25 Bytes
-        recipient_addr = self.get_pub_key_script(ui.qrcode_description.text())
+        recipient_addr = self.get_pub_key_script(self.btc_addr)
+        script_len = bytes([len(recipient_addr)]) # Standard PkScript len = 25 Bytes, SegWit = 22 Bytes
 
         output_self = (
             value
@@ -1112,7 +3484,7 @@ class transaction_helper:
           + recipient_addr
           )
 
-      all_outputs = output_target + output_self
+      all_outputs = b''.join(output_target) + output_self
       return all_outputs
 
   def get_op_code(self, code, constant = None):
@@ -1184,22 +3556,353 @@ class transaction_helper:
       raise SpellingMistake()
     return struct.pack('<L', code_value)
 
+class payment_queue:
+  """ Collects payments which are paid together in one transaction.
+
+  Paying many targets with one transaction needs less signatures 
+  and less fees than paying each of them on its own.
+  """
+  def __init__(self):
+    self._payments = []
+
+  def __len__(self):
+    return len(self._payments)
+
+  def add(self, btc_addr, amount):
+    """ Adds a payment of `amount` Satoshi to `btc_addr`.
+    """
+    btc_addr = btc_addr.strip()
+    check_btc_addr(btc_addr)
+    amount = str(amount).strip()
+    if(not amount.isdigit()):
+      raise Warning('Invalid amount for ' + btc_addr + ': ' + amount)
+    if(int(amount) < transaction_helper.min_tx_amount):
+      raise Warning('Payment to ' + btc_addr + ' falls under Dust value!')
+    self._payments.append((btc_addr, int(amount)))
+
+  def import_csv(self, csv_path):
+    """ Adds all payments of a csv file with the target address in 
+    the first and the amount in Satoshi in the second column.
+
+    Empty lines, lines starting with `#` and a header line are skipped.
+    Returns the number of imported payments. If a line is invalid, 
+    no payment of the file is imported.
+    """
+    payments = []
+    with open(csv_path, newline = '') as csv_file:
+      for row_number, row in enumerate(csv.reader(csv_file)):
+        if((not row) or (not row[0].strip()) or row[0].strip().startswith('#')):
+          continue
+        if(len(row) < 2):
+          raise Warning('Invalid payment in line ' + str(row_number + 1) + ' of ' + os.path.basename(csv_path))
+        if((0 == row_number) and (not row[1].strip().isdigit())):
+          continue # Header
+        if(not row[1].strip().isdigit()):
+          raise Warning('Invalid payment in line ' + str(row_number + 1) + ' of ' + os.path.basename(csv_path))
+        payments.append((row[0], row[1].strip()))
+
+    queue_length = len(self._payments)
+    try:
+      for btc_addr, amount in payments:
+        self.add(btc_addr, amount)
+    except Exception:
+      del self._payments[queue_length:]
+      raise
+    return len(payments)
+
+  def get_payments(self):
+    """ Returns a copy of all queued payments.
+    """
+    return list(self._payments)
+
+  def get_total(self):
+    """ Returns the amount of all queued payments together.
+    """
+    return sum(amount for btc_addr, amount in self._payments)
+
+  def clear(self):
+    """ Removes all queued payments.
+    """
+    self._payments = []
+
+class coin_selection:
+  """ Chooses which unspent outputs are spent by a transaction.
+
+  Every spent output needs its own signature from the card, so the 
+  fewer outputs are spent the faster the transaction is signed and 
+  the less signature counters are used up.
+
+  `branch_and_bound` searches for the fewest outputs that pay the 
+  target without any change, which means their total may only exceed 
+  the target by less than `cost_of_change`. If there is no such 
+  combination it falls back to `largest_first`, which spends the 
+  biggest outputs until the target is reached.
+  """
+  def __init__(self, values, cost_of_change):
+    self.values = values
+    self.cost_of_change = cost_of_change
+    self.max_tries = 100000
+    self._tries = 0
+    self._best = None
+
+  def select(self, target, strategy = 'branch_and_bound'):
+    """ Returns the indices of the outputs to spend for `target` 
+    Satoshi, in their original order.
+
+    If all outputs together are not enough, all of them are returned 
+    and the balance check of the transaction takes care of the rest.
+    """
+    if(sum(self.values) < target):
+      return list(range(len(self.values)))
+
+    if('branch_and_bound' == strategy):
+      selection = self.branch_and_bound(target)
+      if(None == selection):
+        message('No changeless selection found, falling back to largest first!', 'dev')
+        selection = self.largest_first(target)
+    elif('largest_first' == strategy):
+      selection = self.largest_first(target)
+    elif('all' == strategy):
+      selection = list(range(len(self.values)))
+    else:
+      raise SpellingMistake()
+    return sorted(selection)
+
+  def largest_first(self, target):
+    """ Spends the biggest outputs until `target` is reached.
+
+    This needs the smallest possible number of outputs, but usually 
+    leaves some change.
+    """
+    order = sorted(range(len(self.values)), key = lambda index: self.values[index], reverse = True)
+    selection = []
+    total = 0
+    for index in order:
+      if(total >= target):
+        break
+      selection.append(index)
+      total = total + self.values[index]
+    return selection
+
+  def branch_and_bound(self, target):
+    """ Searches the combination with the fewest outputs whose total 
+    lies between `target` and `target + cost_of_change`.
+
+    Returns `None` if there is no such combination or the search 
+    took more than `max_tries` steps.
+    """
+    order = sorted(range(len(self.values)), key = lambda index: self.values[index], reverse = True)
+    sorted_values = [self.values[index] for index in order]
+    remaining = [0] * (len(sorted_values) + 1)
+    for position in range(len(sorted_values) - 1, -1, -1):
+      remaining[position] = remaining[position + 1] + sorted_values[position]
+
+    self._tries = 0
+    self._best = None
+    self._search(sorted_values, remaining, target, 0, 0, [])
+    if(None == self._best):
+      return None
+    return [order[position] for position in self._best[1]]
+
+  def _search(self, sorted_values, remaining, target, position, total, selected):
+    """ Depth first search that either includes or excludes the 
+    output at `position`, cutting branches that can not lead to a 
+    better combination.
+    """
+    self._tries = self._tries + 1
+    if(self._tries > self.max_tries):
+      return
+    if(total > target + self.cost_of_change):
+      return
+    if(total >= target):
+      candidate = (len(selected), total - target)
+      if((None == self._best) or (candidate < self._best[0])):
+        self._best = (candidate, list(selected))
+      return
+    if(total + remaining[position] < target):
+      return
+    if((None != self._best) and (len(selected) + 1 > self._best[0][0])):
+      return
+
+    selected.append(position)
+    self._search(sorted_values, remaining, target, position + 1, total + sorted_values[position], selected)
+    selected.pop()
+    self._search(sorted_values, remaining, target, position + 1, total, selected)
+
+class utxo_store:
+  """ Keeps the unspent outputs of every used address locally.
+
+  After a transaction is broadcasted, the server may still return the 
+  outputs it spent and not yet return its change for a while. The 
+  store therefore marks spent outputs and adds the own change right 
+  after broadcasting, so the next transaction can start right away 
+  without asking the server first. Whenever the server is asked 
+  again, its answer is merged with these local changes until it has 
+  caught up with them or they are older than `pending_timeout`.
+  """
+  def __init__(self):
+    self.pending_timeout = 3600 # Seconds
+    self._addresses = {}
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def get_outpoint(unspent_output):
+    """ Returns the key which identifies an unspent output.
+    """
+    return unspent_output['tx_hash'] + ':' + str(unspent_output['tx_output_n'])
+
+  def get_unspent_outputs(self, btc_addr):
+    """ Returns the unspent outputs of `btc_addr`.
+
+    Only addresses that are not known yet are requested from the server.
+    """
+    with self._lock:
+      known = btc_addr in self._addresses
+    if(not known):
+      self.reconcile(btc_addr)
+    with self._lock:
+      return list(self._addresses[btc_addr]['outputs'].values())
+
+  def get_balance(self, btc_addr):
+    """ Returns the balance of all locally known unspent outputs 
+    or `None` if the address is not known yet.
+    """
+    with self._lock:
+      if(btc_addr not in self._addresses):
+        return None
+      return sum(output['value'] for output in self._addresses[btc_addr]['outputs'].values())
+
+  def reconcile(self, btc_addr):
+    """ Requests the unspent outputs of `btc_addr` from the server 
+    and merges them with the local changes.
+    """
+    server_outputs = blockchain_info.fetch_unspent_outputs(btc_addr)
+    now = time()
+    with self._lock:
+      address = self._addresses.setdefault(btc_addr, {'outputs': {}, 'spent': {}, 'pending': {}})
+      server_outpoints = {}
+      for output in server_outputs:
+        server_outpoints[self.get_outpoint(output)] = output
+
+      # Spent outputs stay hidden until the server stops returning them
+      for outpoint, spent_time in list(address['spent'].items()):
+        if((outpoint not in server_outpoints) or (now - spent_time > self.pending_timeout)):
+          del address['spent'][outpoint]
+
+      outputs = {}
+      for outpoint, output in server_outpoints.items():
+        if(outpoint not in address['spent']):
+          outputs[outpoint] = output
+
+      # Own change stays available until the server returns it as well
+      for outpoint, (output, added_time) in list(address['pending'].items()):
+        if((outpoint in server_outpoints) or (now - added_time > self.pending_timeout)):
+          del address['pending'][outpoint]
+        else:
+          outputs[outpoint] = output
+
+      address['outputs'] = outputs
+    message('Reconciled %d unspent outputs of %s', 'dev', len(outputs), btc_addr)
+
+  def reconcile_in_background(self, btc_addr):
+    """ Reconciles `btc_addr` without waiting for the server.
+    """
+    workers.submit(self._try_reconcile, btc_addr)
+
+  def _try_reconcile(self, btc_addr):
+    try:
+      self.reconcile(btc_addr)
+    except Exception as details:
+      message('Unspent outputs not reconciled: %s', 'dev', details)
+
+  def check_balance(self, btc_addr, balance):
+    """ Reconciles `btc_addr` in the background if the server 
+    reports another balance than the local unspent outputs add up to.
+    """
+    local_balance = self.get_balance(btc_addr)
+    if((None != local_balance) and (local_balance != balance)):
+      self.reconcile_in_background(btc_addr)
+
+  def apply_transaction(self, btc_addr, spent_outputs, change_outputs):
+    """ Marks `spent_outputs` as spent and adds `change_outputs` 
+    after a transaction of `btc_addr` has been broadcasted.
+    """
+    now = time()
+    with self._lock:
+      address = self._addresses.setdefault(btc_addr, {'outputs': {}, 'spent': {}, 'pending': {}})
+      for output in spent_outputs:
+        outpoint = self.get_outpoint(output)
+        address['spent'][outpoint] = now
+        address['outputs'].pop(outpoint, None)
+      for output in change_outputs:
+        outpoint = self.get_outpoint(output)
+        address['pending'][outpoint] = (output, now)
+        address['outputs'][outpoint] = output
+
 class blockchain_info:
   """ Manages information from the website Blockchain.info.
   
   This is done to recieve the unspent outputs of a 
   Bitcoin address or the current exchange rate of Bitcoin.
   """
+  max_batch_size = 100 # Addresses per balance request
+
   def __init__(self, btc_addr):
+    try:
+      self._all_data = utxos.get_unspent_outputs(btc_addr)
+    except Exception as details:
+      raise Warning('No valid btc address or no unspent outputs!')
+    if(not self._all_data):
+      raise Warning('No valid btc address or no unspent outputs!')
+    self._data = self._all_data
+
+  @staticmethod
+  def fetch_unspent_outputs(btc_addr):
+    """ Downloads the unspent outputs of `btc_addr`.
+    """
     confirmed = 0 # This should be set to 6 if you want to make sure that the previous transaction is definitly valid. 
     max_inputs = 50
     restrictions = '&confirmations=' + str(confirmed) + '&limit=' + str(max_inputs)
-    url = 'https://blockchain.info/unspent?active=' + btc_addr + restrictions
+    url = blockchain_url + '/unspent?active=' + btc_addr + restrictions
     try:
-      unspent_outputs_data = json.loads(urlopen(url, timeout = default_wait).read())
-    except Exception as details:
-      raise Warning('No valid btc address or no unspent outputs!')
-    self._data = unspent_outputs_data['unspent_outputs']
+      # Blockchain.info answers with HTTP 500 if there are no unspent 
+      # outputs, which is no reason to ask again.
+      unspent_outputs_data = http_session.get_json(url, expected_errors = ('No free outputs',))
+    except RuntimeError as details:
+      if('No free outputs' in str(details)):
+        return []
+      raise
+    return unspent_outputs_data['unspent_outputs']
+
+  @staticmethod
+  def fetch_balances(btc_addrs):
+    """ Downloads the balances of all `btc_addrs` in Satoshi, 
+    including unconfirmed transactions.
+
+    Only a summary of each address is requested, not its 
+    transactions. Up to `max_batch_size` addresses share a request.
+    Returns a dictionary of address -> balance.
+    """
+    btc_addrs = list(dict.fromkeys(btc_addrs)) # Without duplicates
+    balances = {}
+    for batch in range(0, len(btc_addrs), blockchain_info.max_batch_size):
+      batch_addrs = btc_addrs[batch:batch + blockchain_info.max_batch_size]
+      url = blockchain_url + '/balance?active=' + '|'.join(batch_addrs)
+      balance_data = http_session.get_json(url)
+      for btc_addr in batch_addrs:
+        balances[btc_addr] = balance_data[btc_addr]['final_balance']
+    return balances
+
+  def select_unspent_outputs(self, target, cost_of_change):
+    """ Narrows the unspent outputs down to the ones which are spent 
+    to pay `target` Satoshi.
+
+    See `coin_selection` for how they are chosen.
+    """
+    values = [unspent_output['value'] for unspent_output in self._all_data]
+    selection = coin_selection(values, cost_of_change).select(target, coin_selection_strategy)
+    self._data = [self._all_data[output_number] for output_number in selection]
+    message('Selected %d of %d unspent outputs', 'dev', len(self._data), len(self._all_data))
 
   def get_total_input_number(self):
     """ Describes how many unspent outputs i.e. inputs exist.
@@ -1225,12 +3928,186 @@ class blockchain_info:
     """
     return self._data[output_number]['tx_output_n']
 
+  def get_value(self, output_number):
+    """ Returns the value of an unspent output in Satoshi.
+    """
+    return self._data[output_number]['value']
+
+  def get_unspent_outputs(self):
+    """ Returns the unspent outputs which are spent.
+    """
+    return list(self._data)
+
+class currency_ticker:
+  """ Keeps the exchange rate of Bitcoin up to date.
+
+  The exchange rate is refreshed on its own schedule, so that 
+  converting amounts never has to wait for the server.
+  """
+  def __init__(self, currency = 'EUR', interval = 300):
+    self.currency = currency
+    self.interval = interval # Seconds
+    self.rate = None
+    self.updated = None
+    self.job_name = 'exchange rate ' + currency
+
+  def refresh(self):
+    """ Requests the current exchange rate.
+    """
+    currency_url = blockchain_url + '/ticker'
+    self.rate = http_session.get_json(currency_url)[self.currency]['sell']
+    self.updated = time()
+    message('Exchange rate updated: %s', 'dev', self.rate)
+
+  def _try_refresh(self):
+    try:
+      self.refresh()
+    except Exception as details:
+      message('Exchange rate not updated: %s', 'dev', details)
+
+  def start(self):
+    """ Refreshes the exchange rate in the background, unless it is 
+    already being kept up to date.
+    """
+    if(not scheduler.is_scheduled(self.job_name)):
+      scheduler.call_every(self.job_name, self.interval, workers.submit, self._try_refresh, delay = 0)
+
+  def stop(self):
+    """ Stops refreshing the exchange rate.
+    """
+    scheduler.cancel(self.job_name)
+
+  def get_age(self):
+    """ Returns the age of the exchange rate in seconds.
+    """
+    if(None == self.updated):
+      return None
+    return time() - self.updated
+
+class electrum_notifier:
+  """ Gets the balance of addresses pushed by an Electrum server 
+  whenever it changes, including changes in the mempool.
+
+  `on_change` is called with the address and its new balance. 
+  `on_lost` is called if the server can not be reached anymore.
+  """
+  def __init__(self, on_change, on_lost, server = None):
+    self.server = server or electrum_server
+    self.on_change = on_change
+    self.on_lost = on_lost
+    self.client = None
+    self._addresses = {} # Script hash -> address
+
+  @staticmethod
+  def get_script_hash(btc_addr):
+    """ Electrum knows addresses by the reversed SHA256 hash 
+    of their PkScript.
+    """
+    pub_key_script = transaction_helper(None, None).get_pub_key_script(btc_addr)
+    return hashlib.sha256(pub_key_script).digest()[::-1].hex()
+
+  def subscribe(self, btc_addr):
+    """ Asks the server to push every change of `btc_addr`.
+    """
+    if(None == self.client):
+      client = electrum_client(self.server, self._notified, self._closed)
+      client.connect()
+      self.client = client
+    script_hash = self.get_script_hash(btc_addr)
+    self._addresses[script_hash] = btc_addr
+    self.client.request('blockchain.scripthash.subscribe', script_hash)
+
+  def get_balance(self, btc_addr):
+    """ Returns the balance of `btc_addr` in Satoshi, including 
+    unconfirmed transactions.
+    """
+    balance = self.client.request('blockchain.scripthash.get_balance', self.get_script_hash(btc_addr))
+    return balance['confirmed'] + balance['unconfirmed']
+
+  def stop(self):
+    """ Stops all notifications.
+    """
+    self._addresses.clear()
+    if(self.client):
+      self.client.close()
+      self.client = None
+
+  def _notified(self, method, params):
+    if(('blockchain.scripthash.subscribe' == method) and (params[0] in self._addresses)):
+      # Requests can not be sent from the thread reading the connection
+      workers.submit(self._changed, self._addresses[params[0]])
+
+  def _changed(self, btc_addr):
+    self.on_change(btc_addr, self.get_balance(btc_addr))
+
+  def _closed(self):
+    self.client = None
+    self.on_lost()
+
 class blockchain_info_poll:
   """ Manages the polling of the currency data.
+
+  If balance notifications are available, the balance is only 
+  requested once and then updated whenever the server pushes a 
+  change. Otherwise it gets polled.
+
+  Connecting to a server which is not reachable blocks a worker until 
+  the timeout, so after a failure the notifications are only tried 
+  again after `retry_delay`, which doubles with every further failure.
   """
+  min_retry_delay = default_wait * polling_multiplier # Seconds
+  max_retry_delay = 3600 # Seconds
+  retry_delay = min_retry_delay # Shared by all polls, it is the same server
+  retry_at = 0 # See `monotonic`
+
   def __init__(self, btc_addr):
+    self.btc_addr = btc_addr
+    self.notifier = None
+    if(balance_notifications not in ('electrum', 'poll')):
+      raise SpellingMistake()
     self.currency_rate = self.update_currency_rate(btc_addr)
 
+  def start_notifications(self, btc_addr):
+    """ Subscribes to balance notifications for `btc_addr`.
+
+    Returns False if the server is not reachable.
+    """
+    notifier = electrum_notifier(self.balance_changed, self.notifications_lost)
+    try:
+      notifier.subscribe(btc_addr)
+    except Exception as details:
+      notifier.stop()
+      blockchain_info_poll.retry_at = monotonic() + blockchain_info_poll.retry_delay
+      message('No balance notifications for %d seconds, polling instead: %s', 'dev', blockchain_info_poll.retry_delay, details)
+      blockchain_info_poll.retry_delay = min(2 * blockchain_info_poll.retry_delay, self.max_retry_delay)
+      return False
+    blockchain_info_poll.retry_delay = self.min_retry_delay
+    self.notifier = notifier
+    message('Subscribed to balance notifications!', 'dev')
+    return True
+
+  def stop(self):
+    """ Stops polling and notifications.
+    """
+    poll.stop()
+    if(self.notifier):
+      self.notifier.stop()
+      self.notifier = None
+
+  def balance_changed(self, btc_addr, balance):
+    """ Shows a balance pushed by the notifier.
+    """
+    message('Balance changed: %s', 'dev', balance)
+    self.show_balance(btc_addr, balance)
+    gui.call(self.update_conversion)
+
+  def notifications_lost(self):
+    """ Falls back to polling once the notifier lost its server.
+    """
+    self.notifier = None
+    message('Balance notifications lost, polling instead!', 'dev')
+    poll.start(default_wait * polling_multiplier, self.update_currency_rate, self.btc_addr)
+
   def update_currency_rate(self, btc_addr = None):
     """ Updates all currency values present on the UI 
     to keep them up to date.
@@ -1239,58 +4116,86 @@ class blockchain_info_poll:
     in the whole program. This is done because on weak 
     systems, such as an Raspberry Pi, executing this 
     function too frequently can cause errors.
+    It runs on a worker or poll thread, the UI is only 
+    changed through the GUI thread.
+    While balance notifications are active it is not polled.
     """
     poll.stop()
     message('Polling currency rate and/or updating balance!', 'dev')
+    if(btc_addr and ('electrum' == balance_notifications) and (None == self.notifier)
+        and (monotonic() >= self.retry_at)):
+      self.start_notifications(btc_addr) # Before the balance, so no change is missed
     try:
       if(btc_addr):
-        currency_url = 'https://blockchain.info/ticker'
-        balance_url = 'https://blockchain.info/rawaddr/' + btc_addr
-        self.currency_rate = json.loads(urlopen(currency_url, timeout = default_wait).read())['EUR']['sell']
-        current_balance = json.loads(urlopen(balance_url, timeout = default_wait).read())['final_balance']
-        if(0 != current_balance):
-          balance_mbtc = '%0.3f' % self.currency_conversion('SAT_MBTC', current_balance)
-          balance_euro = '%0.3f' % self.currency_conversion('SAT_EURO', current_balance)
-          ui.balance.setText(
-              'Current balance:\n'
-            + '(including unconfirmed)\n' 
-            + str(balance_mbtc)
-            + ' Milli-Bitcoin\n'
-            + str(current_balance) 
-            + ' Satoshi\n'
-            + str(balance_euro)
-            + ' Euro'
-            )
-        else:
-          ui.balance.setText(
-              'Current balance:\n' 
-            + 'No money on this address!'
-            )
+        if(None == ticker.rate):
+          ticker.refresh()
+        self.currency_rate = ticker.rate
+        current_balance = blockchain_info.fetch_balances([btc_addr])[btc_addr]
+        self.show_balance(btc_addr, current_balance)
     except Exception as details:
-      ui.balance.setText('This application needs a valid internet connection to function as intended!')
+      gui.call(ui.balance.setText, 'This application needs a valid internet connection to function as intended!')
       raise Warning('Please check the internet connection! ' + str(details))
     
-    if(self.currency_conversion):
-      amount_euro = '%0.3f' % self.currency_conversion('SAT_EURO', int(ui.amount.text()))
-      fee_euro = '%0.3f' % self.currency_conversion('SAT_EURO', int(ui.fee.text()))
+    gui.call(self.update_conversion)
+
+    if(btc_addr and (None == self.notifier)):
+      poll.start(default_wait * polling_multiplier, self.update_currency_rate, btc_addr)
+    return self.currency_rate
+
+  def show_balance(self, btc_addr, current_balance):
+    """ Shows `current_balance` of `btc_addr` on the UI.
+    """
+    utxos.check_balance(btc_addr, current_balance)
+    if(0 != current_balance):
+      balance_mbtc = '%0.3f' % self.currency_conversion('SAT_MBTC', current_balance)
+      balance_euro = '%0.3f' % self.currency_conversion('SAT_EURO', current_balance)
+      gui.call(ui.balance.setText,
+          'Current balance:\n'
+        + '(including unconfirmed)\n' 
+        + str(balance_mbtc)
+        + ' Milli-Bitcoin\n'
+        + str(current_balance) 
+        + ' Satoshi\n'
+        + str(balance_euro)
+        + ' Euro'
+        )
+    else:
+      gui.call(ui.balance.setText,
+          'Current balance:\n' 
+        + 'No money on this address!'
+        )
+
+  def update_conversion(self):
+    """ Converts the amount and fee fields into Euro.
+
+    Only the last known exchange rate is used, no request is sent.
+    """
+    self.currency_rate = ticker.rate
+    if(self.currency_rate):
+      amount_euro = '%0.3f' % self.currency_conversion('SAT_EURO', int(ui.amount.text() or 0))
+      fee_euro = '%0.3f' % self.currency_conversion('SAT_EURO', int(ui.fee.text() or 0))
+      rate_info = 'Exchange rate from ' + strftime('%H:%M:%S', localtime(ticker.updated))
+      currency_name = ' Euro'
+      # The rate could not be refreshed for a while, e.g. when offline
+      if(ticker.get_age() > 2 * ticker.interval):
+        rate_info = rate_info + ' (outdated)'
+        currency_name = ' Euro (outdated)'
             
       ui.amount_converter.setText(
         'Satoshi = ' 
         + str(amount_euro)
-        + ' Euro'
+        + currency_name
         )
+      ui.amount_converter.setToolTip(rate_info)
       ui.fee_converter.setText(
         'Satoshi = ' 
         + str(fee_euro)
-        + ' Euro'
+        + currency_name
         )
+      ui.fee_converter.setToolTip(rate_info)
     else:
       raise Warning('Currency conversion rate not available!')
 
-    if(btc_addr):
-      poll.start(default_wait * polling_multiplier, self.update_currency_rate, btc_addr)
-    return self.currency_rate
-
   def currency_conversion(self, conversion_type, currency):
     """ Converts currency depending on `conversion_type`.
     """
@@ -1309,21 +4214,58 @@ class blockchain_info_poll:
     else:
       raise SpellingMistake()
 
-if __name__ == '__main__':
+def setup(data_dir = None):
+  """ Sets up everything Praesidium needs, up to the loaded UI.
+
+  Files are saved in `data_dir`, by default in the praesidium folder 
+  (logs and signatures in its `transaction logs` folder).
+  """
+  global scheduler, timer, poll, http_session, tx_logs, signing_sessions, gui, workers
+  global events, diagnostics, status_updates, metrics, metrics_endpoint
+  global cardmonitor, cardobserver, readers, reader, key_cache
+  global utxos, ticker, app, ui
+
   ## Utility
+  scheduler = job_scheduler()
   timer = timer_class()
-  poll = timer_class()
+  poll = timer_class(on_worker = True)
+  http_session = http_client()
+  tx_logs = log_store(os.path.join(data_dir, 'transaction_logs.db') if(data_dir) else None)
+  signing_sessions = signing_session_store(os.path.join(data_dir, 'signing_sessions.db') if(data_dir) else None)
+  gui = gui_dispatcher()
+  workers = worker_pool()
+  events = event_buffer()
+  diagnostics = create_diagnostics(events)
+  status_updates = status_bar_updater()
+  metrics = metrics_registry()
+  metrics_endpoint = None # See start_metrics
 
   ## Card / reader
-  cardmonitor, cardobserver = observer.start()
-  reader = reader_info()
+  cardmonitor, cardobserver = None, None # See start_card_monitor
+  readers = reader_pool([reader_name] + other_reader_names)
+  reader = readers.sessions[0] # Reader of the shown card
+  key_cache = keypair_cache(os.path.join(data_dir, 'keypair_cache.json') if(data_dir) else None)
+
+  ## Bitcoin
+  utxos = utxo_store()
+  ticker = currency_ticker()
 
   ## UI
-  app = QApplication()
+  app = QApplication.instance() or QApplication([])
   app.aboutToQuit.connect(close_event)
   ui = UI.load()
+
+def main(data_dir = None):
+  """ Starts Praesidium and runs it until the window is closed.
+  """
+  setup(data_dir)
   ui.show_window()
+  app.processEvents() # Paint the window before the card library is loaded
 
   # Start application
-  blocksec2go.add_callback(connect = card_connect, disconnect = card_disconnect)
-  app.exec_()
\ No newline at end of file
+  start_metrics()
+  start_card_monitor()
+  app.exec_()
+
+if __name__ == '__main__':
+  main()
\ No newline at end of file